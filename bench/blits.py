@@ -0,0 +1,49 @@
+'''
+Compares block blit throughput with the images as loaded from disk
+against the converted texture atlas, on the dense levels.
+
+python -m bench.blits [frames]
+'''
+import os
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+pygame.init()
+screen = pygame.display.set_mode((800, 600))
+
+from game.level_constructor import LevelConstructor
+from util.setup import BLOCK_ATLAS, load_image
+
+
+def run(blocks, frames):
+    # blit every block (image, rect) of the level, camera scrolling down the level.
+    start = time.perf_counter()
+    for i in range(frames):
+        y = -(i * 10 % 4000)
+        for image, rect in blocks:
+            screen.blit(image, rect.move(0, y))
+    return len(blocks) * frames / (time.perf_counter() - start)
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    loaded = {path : load_image(path) for path in BLOCK_ATLAS.paths()}
+    handles = {BLOCK_ATLAS.image(path).get_offset() : path for path in BLOCK_ATLAS.paths()}
+
+    for level in ['9', '10']:
+        store = LevelConstructor.get_level(level).blocks
+        blocks = [(store.surfaces[store.image[i]], store.rect(i)) for i in store.indices()]
+        raw = [(loaded[handles[image.get_offset()]], rect) for image, rect in blocks]
+
+        before = run(raw, frames)
+        after = run(blocks, frames)
+        print(f'level {level}: {len(blocks)} blocks, {before:,.0f} blits/s loaded, {after:,.0f} blits/s atlas ({after / before:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+'''
+Plays every level in game/levels.py and endless mode headlessly with the
+scripted player, and reports frames per second and per-phase frame times
+(collision, endless chunk swap-in, draw). Results are saved as json so runs can
+be compared across commits.
+
+python -m bench.suite [frames] [--endless frames] [--only 9,10,endless] [--seed n] [--out file] [--compare old.json]
+'''
+import json
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from headless import run_single, ASSETS
+from game.levels import LEVELS
+from game.states import LevelSingle, EndlessSingle
+from game.sprites import Player
+from game.level_constructor import LevelConstructor
+from util.profiler import FrameProfiler
+
+# (class, method, phase): time spent in these is counted in that phase.
+# Only the player's checks count as collision: drawing culls with BlockStore.collide too.
+# update_block_chunks drops passed blocks and adds the next chunk (endless only).
+# The chunks are rolled on CHUNK_WORKER, so this is the main thread's share:
+# adding the blocks, and waiting for a chunk that is not built yet.
+TIMED = [
+    (Player, 'check_collisions', 'collision'),
+    (Player, 'check_block_break', 'collision'),
+    (LevelConstructor, 'update_block_chunks', 'chunks'),
+]
+
+
+@contextmanager
+def instrumented(profiler):
+    '''
+    Counts the time spent in the TIMED methods in profiler while active.
+    '''
+    def timed(method, phase):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profiler.add(phase, time.perf_counter() - start)
+        return wrapper
+
+    originals = [(cls, name, cls.__dict__[name]) for cls, name, phase in TIMED]
+    for cls, name, phase in TIMED:
+        setattr(cls, name, timed(cls.__dict__[name], phase))
+    try:
+        yield profiler
+    finally:
+        for cls, name, method in originals:
+            setattr(cls, name, method)
+
+
+def run_case(name, new_state, frames):
+    '''
+    Plays the case for frames frames, starting it again whenever
+    the scripted player dies or wins before that.
+    '''
+    profiler = FrameProfiler(phases=('events', 'update', 'draw'), window=frames, nested=('collision', 'chunks'))
+    played, seconds, runs = 0, 0, 0
+    with instrumented(profiler):
+        while played < frames:
+            state = new_state()
+            result = run_single(state, frames - played, draw=True, profiler=profiler)
+            played += result['frames']
+            seconds += result['wall seconds']
+            runs += 1
+
+    phases = profiler.stats()
+    for phase, samples in profiler.samples.items():
+        phases[phase]['mean'] = round(sum(samples) / len(samples) * 1000, 3) if samples else 0
+    return {
+        'case' : name,
+        'frames' : played,
+        'runs' : runs,
+        'fps' : round(played / seconds) if seconds else 0,
+        'phases' : phases,
+        'block store' : state.blocks.stats() # last run only
+    }
+
+
+def cases(frames, endless_frames, seed, only=None):
+    '''
+    Yields (name, state factory, frames) for each level and endless,
+    or only for the names in only. Endless chunks are rolled from seed.
+    '''
+    every = [(level, lambda level=level: LevelSingle(images=ASSETS.get('states'), level=level), frames) for level in LEVELS]
+    every.append(('endless', lambda: EndlessSingle(images=ASSETS.get('states'), seed=seed), endless_frames))
+    for case in every:
+        if only is None or case[0] in only:
+            yield case
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def report(run, previous=None):
+    before = {case['case'] : case for case in previous['cases']} if previous else {}
+    print(f'{"case":<10}{"frames":>7}{"runs":>5}{"fps":>8}{"collision":>11}{"chunks":>8}{"draw":>8}{"frame":>8}  (mean ms)')
+    for case in run['cases']:
+        p = case['phases']
+        line = f'{case["case"]:<10}{case["frames"]:>7}{case["runs"]:>5}{case["fps"]:>8}{p["collision"]["mean"]:>11.3f}{p["chunks"]["mean"]:>8.3f}{p["draw"]["mean"]:>8.3f}{p["frame"]["mean"]:>8.3f}'
+        old = before.get(case['case'])
+        if old and old['fps']:
+            line += f'  {case["fps"] / old["fps"]:.2f}x fps vs {previous["commit"]}'
+        print(line)
+
+
+def option(args, name, default):
+    if name in args:
+        i = args.index(name)
+        value = args[i + 1]
+        del args[i:i + 2]
+        return value
+    return default
+
+
+def main(args):
+    args = list(args)
+    endless_frames = int(option(args, '--endless', 0))
+    only = option(args, '--only', None)
+    seed = int(option(args, '--seed', 1))
+    compare = option(args, '--compare', None)
+    out = option(args, '--out', None)
+    frames = int(args[0]) if args else 1800
+    endless_frames = endless_frames or frames * 4 # the long run
+    only = only.split(',') if only else None
+
+    run = {'commit' : commit(), 'date' : time.strftime('%Y-%m-%d %H:%M:%S'), 'seed' : seed, 'cases' : []}
+    for name, new_state, n in cases(frames, endless_frames, seed, only):
+        run['cases'].append(run_case(name, new_state, n))
+        print(f'[Bench] {name}: {run["cases"][-1]["fps"]} fps')
+
+    previous = None
+    if compare:
+        with open(compare) as f:
+            previous = json.load(f)
+    report(run, previous)
+
+    out = out or f'bench_{run["commit"] or time.strftime("%Y%m%d_%H%M%S")}.json'
+    with open(out, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f'[Bench] Saved results to {out}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
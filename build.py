@@ -1,5 +1,6 @@
 import subprocess
 import sys
+from util.bundle import build_bundle
 
 def build_game(n):
     if n == 0:
@@ -14,6 +15,14 @@ def build_game(n):
     elif n == 3:
         subprocess.call(r"pyinstaller --onefile host.py")
         print('Done build server executable')
+    elif n == 4:
+        build_bundle()
+        print('Done build asset bundle')
+    elif n == 5:
+        # Assets are packed into one memory-mapped bundle instead of dozens of loose files.
+        build_bundle()
+        subprocess.call(r"pyinstaller --windowed --icon=res/icon/game_icon.ico --onefile --add-data config.json;. --add-data assets.bundle;. --add-data res/icon/*;res/icon play.py")
+        print('Done build single executable with asset bundle')
     else:
         print('Invalid build number.')
 
@@ -21,7 +30,7 @@ args = sys.argv
 if len(args) > 1:
     build_game(int(args[1]))
 else:
-    print('Build options:\n0 - Debug\n1 - clean\n2 - single executable\n3 - Only server executable')
+    print('Build options:\n0 - Debug\n1 - clean\n2 - single executable\n3 - Only server executable\n4 - Only asset bundle\n5 - single executable with asset bundle')
     build_game(int(input()))
 
 
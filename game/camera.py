@@ -59,6 +59,11 @@ class Camera():
         # Call on most objects when drawing.
         # Returns the modified rect. 
         return target.rect.move(self.rect.topleft)
+
+    def view(self):
+        # Returns the area of the world currently on screen.
+        # Use to skip drawing anything outside of it.
+        return pygame.Rect(-self.rect.x, -self.rect.y, self.rect.width, self.rect.height)
     
     def update_camera(self, target, clock=None):
         # Moves the camera's rect to the target depending on mode set.
@@ -0,0 +1,64 @@
+import pygame
+
+'''
+Where the player's key presses come from.
+The game reads the keyboard; headless runs (see headless.py) play from a script.
+'''
+
+class KeyboardInput:
+    '''
+    Reads the real keyboard.
+    '''
+    def pressed(self):
+        return pygame.key.get_pressed()
+
+
+class HeldKeys:
+    '''
+    Answers keys[pygame.K_x] like pygame.key.get_pressed() does.
+    '''
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __getitem__(self, key):
+        return key in self.keys
+
+
+class ScriptedInput:
+    '''
+    Plays input from a script instead of the keyboard.
+    script(frame) returns (keys held, keys tapped) for that frame;
+    taps come back from next_frame() as KEYDOWN events for handle_events.
+    '''
+    def __init__(self, script):
+        self.script = script
+        self.frame = 0
+        self.held = HeldKeys(set())
+
+    def pressed(self):
+        return self.held
+
+    def next_frame(self):
+        held, tapped = self.script(self.frame)
+        self.frame += 1
+        self.held = HeldKeys(set(held))
+        return [pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode='', scancode=0) for key in tapped]
+
+
+KEYBOARD = KeyboardInput()
+
+
+def digger(frame):
+    '''
+    A simple script: dig down, break a block every 8 frames,
+    and every few seconds walk sideways and jump to get unstuck.
+    '''
+    held, tapped = [pygame.K_DOWN], []
+    phase = frame % 240
+    if phase >= 200:
+        held = [pygame.K_RIGHT if frame // 240 % 2 else pygame.K_LEFT]
+        if phase == 200:
+            tapped.append(pygame.K_UP)
+    if frame % 8 == 0:
+        tapped.append(pygame.K_SPACE)
+    return held, tapped
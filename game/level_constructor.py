@@ -1,7 +1,20 @@
 import pygame
 import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
 from game.levels import LEVELS
 from game.sprites import *
+from util.setup import get_config
+
+# Block type -> chance (out of the total) of a endless mode cell being that type.
+# Win blocks, mushroom and invisible blocks are excluded.
+# Can be replaced with a "block_weights" table in config.json, eg. {"0": 50, "3": 15}.
+BLOCK_WEIGHTS = {0 : 50, 3 : 15, 2 : 10, 4 : 13, 10 : 2, 9 : 7, 5 : 1, 6 : 1, 7 : 1}
+
+# Builds endless chunks ahead of time. One thread, so chunks are built in the
+# order they were asked for and the seeded generator gives the same blocks.
+CHUNK_WORKER = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chunk-worker')
 
 class LevelConstructor:
     '''
@@ -26,81 +39,103 @@ class LevelConstructor:
         }
         self.levels = LEVELS
         self.mode = mode
-        self.blocks = pygame.sprite.Group()
+        self.blocks = BlockStore()
         self.chunk_y_pos = 0
         self.chunk_size = 800
         self.start_y_offset = 200
+        self.x_offset = 0
+        self.prefetch = 0 # chunks to build ahead of time on CHUNK_WORKER
+        self.pending = deque() # futures of the chunks being built, oldest first
+        self.waits = 0 # times a chunk was needed before it was ready
+        self.rows = deque() # (grid row, block indices) of the endless rows, top row first
     
     def get_random_chunk(self, x_offset=0):
         '''
         Used with endless mode.
-        Generate a random chunk of blocks, and add it to the Group.
+        Generate a random chunk of blocks, and add it to the BlockStore.
         eg. One chunk = [800x800] space, filled with 100x100 blocks.
+        With prefetch set, the chunk was already rolled in the background
+        and only has to be added.
         '''
         self.x_offset = x_offset
 
-        for i in range((self.chunk_size//100)):
-            for j in range((self.chunk_size//100) - 1, -1, -1):
-                #b = StandardBlock(i*100 + self.x_offset, self.start_y_offset + j*100 + self.chunk_y_pos, 100, 100)
-                b = Block.construct_block_from_type(self.random_block(), i*100 + self.x_offset, self.start_y_offset + j*100 + self.chunk_y_pos, 100, 100 )
-                self.blocks.add(b)
-                #print(b.rect.x, b.rect.y)
-        self.blocks.add(InvisBlock(-100 + self.x_offset, self.start_y_offset + self.chunk_y_pos, 100, 100))
+        if self.pending:
+            chunk = self.pending.popleft()
+            if not chunk.done():
+                self.waits += 1
+            cells = chunk.result()
+        else: # nothing built yet (first chunk, or no prefetch)
+            cells = self.build_chunk()
+
+        rows = {}
+        for b, column, row in cells:
+            rows.setdefault(row, []).append(self.blocks.add(b, column, row))
+        self.rows.extend(sorted(rows.items()))
+
+        while len(self.pending) < self.prefetch:
+            self.pending.append(CHUNK_WORKER.submit(self.build_chunk))
 
-        self.chunk_y_pos += self.chunk_size # go to next chunk position.
-        #print('returning chunk with offset', x_offset)
-        #print(self.blocks.sprites()[0].rect.x)
         return self.blocks
 
+    def build_chunk(self):
+        '''
+        Returns the blocks of the next chunk as [(type, grid column, grid row)],
+        without adding them to the BlockStore.
+        '''
+        cells = self.chunk_size//100
+        column = self.x_offset//100
+        row = (self.start_y_offset + self.chunk_y_pos)//100
+
+        # All the block types of the chunk are rolled at once, column by column (bottom up).
+        types = self.random_blocks(cells * cells)
+        chunk = [(types[i*cells + k], column + i, row + cells - 1 - k) for i in range(cells) for k in range(cells)]
+        chunk.append((99, column - 1, row)) # the marker, see update_block_chunks
+
+        self.chunk_y_pos += self.chunk_size # go to next chunk position.
+        return chunk
+
     def update_block_chunks(self, camera):
         '''
         Used with endless mode.
         Check and delete any blocks outside of camera.
         Also generate new chunk when needed.
+        Rows leave the camera top first, so only the oldest row is checked.
         '''
-        for block in self.blocks:
-            if block.check_position(camera):
-                if block.type == 99:
-                    #print('[Game] Generating new chunk at', self.chunk_y_pos)
+        size = self.blocks.size
+        while self.rows and (self.rows[0][0] + 1)*size < -camera.rect.y:
+            _, row = self.rows.popleft()
+            for i in row:
+                if self.blocks.type[i] == 99:
                     self.get_random_chunk()
-                
-                block.kill()
+                self.blocks.release(i) # removes it too, unless the player already broke it
         
         return self.blocks
 
-    def random_block(self):
-        '''
-        Returns an integer representing the type of block.
-        Win blocks, mushroom and invisible blocks are excluded.
-        '''
-        roll = random.randint(1, 100)
-
-        if roll <= 50:
-            return 0
-        elif roll <= 65:
-            return 3
-        elif roll <= 75:
-            return 2
-        elif roll <= 88:
-            return 4
-        elif roll <= 90:
-            return 10
-        elif roll <= 97:
-            return 9
-        elif roll <= 98:
-            return 5
-        elif roll <= 99:
-            return 6
-        else:
-            return 7
+    def set_block_weights(self, weights):
+        '''
+        Sets the chances of each block type in endless mode (see BLOCK_WEIGHTS).
+        '''
+        self.block_types = [int(t) for t in weights]
+        self.cum_weights = list(accumulate(weights.values()))
+
+    def random_blocks(self, k):
+        '''
+        Returns a list of k integers representing types of blocks.
+        '''
+        return self.rng.choices(self.block_types, cum_weights=self.cum_weights, k=k)
 
     @classmethod
-    def get_endless(cls):
+    def get_endless(cls, seed=None, weights=None, prefetch=2):
         '''
         Returns the endless mode.
+        The same seed gives the same blocks; by default every game is different.
+        The next prefetch chunks are built in the background (0 to build them when needed).
         '''
         level = cls('endless')
         level.ground_level = level.ground_settings[level.mode]
+        level.rng = random.Random(seed)
+        level.set_block_weights(weights or get_config().get('block_weights') or BLOCK_WEIGHTS)
+        level.prefetch = prefetch
         return level
     
     @classmethod
@@ -113,15 +148,19 @@ class LevelConstructor:
        
         blocks_data = LEVELS[l]
 
-        level.blocks.add(cls.read_level(blocks_data))
+        # Ids (indices) follow the level layout, so they are the same on every client.
+        for b, column, row in cls.read_level(blocks_data):
+            level.blocks.add(b, column, row)
 
         return level
     
     @staticmethod
     def read_level(blocks_data):
+        '''
+        Returns the blocks of a level as [(type, grid column, grid row)].
+        '''
         return [
-            block for block in [
-                Block.construct_block_from_type(b, i*100, j*100, 100, 100) if rows or b >= 0 else b
-                for j, rows in enumerate(blocks_data) for i, b in enumerate(rows)
-            ] if isinstance(block, Block)
+            (b, i, j)
+            for j, rows in enumerate(blocks_data) for i, b in enumerate(rows)
+            if b in BLOCK_TYPES
         ]
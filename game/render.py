@@ -0,0 +1,76 @@
+import pygame
+
+COLORKEY = (255, 0, 255)
+
+
+class BlockRenderer:
+    '''
+    Draws the visible blocks of a BlockStore with a single Surface.blits call,
+    instead of one draw call and blit per block.
+    '''
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def draw(self, screen, camera):
+        screen.blits(self.blocks.blit_sequence(camera.view(), camera.rect.topleft), doreturn=False)
+
+
+class LayerCache:
+    '''
+    Draws the blocks of a BlockStore from pre-rendered chunk surfaces.
+    A chunk is rendered the first time it comes on screen and kept
+    until a block inside it changes (see BlockStore.invalidate),
+    so a frame costs a few chunk blits instead of one blit per block.
+    Chunks more than margin chunks away from the screen are dropped.
+    '''
+    def __init__(self, blocks, chunk_size=800, margin=1):
+        self.blocks = blocks
+        self.chunk_size = chunk_size
+        self.margin = margin
+        self.chunks = {} # (column, row) -> rendered Surface
+
+        blocks.layers.append(self)
+
+    def chunks_for(self, rect):
+        c = self.chunk_size
+        return [
+            (i, j)
+            for i in range(rect.left // c, (rect.right - 1) // c + 1)
+            for j in range(rect.top // c, (rect.bottom - 1) // c + 1)
+        ]
+
+    def invalidate(self, rect):
+        # Drops the chunks under rect, they are rendered again when next drawn.
+        for chunk in self.chunks_for(rect):
+            self.chunks.pop(chunk, None)
+
+    def render(self, chunk):
+        c = self.chunk_size
+        area = pygame.Rect(chunk[0] * c, chunk[1] * c, c, c)
+        # Block images are opaque, so a colorkey is enough to show the
+        # background through empty cells, and RLE makes those cheap to skip.
+        surface = pygame.Surface(area.size)
+        surface.fill(COLORKEY)
+
+        surface.blits(self.blocks.blit_sequence(area, (-area.x, -area.y)), doreturn=False)
+
+        surface.set_colorkey(COLORKEY, pygame.RLEACCEL)
+        return surface
+
+    def draw(self, screen, camera):
+        c = self.chunk_size
+        x, y = camera.rect.topleft
+        to_draw = []
+        view = camera.view()
+        for chunk in self.chunks_for(view):
+            surface = self.chunks.get(chunk)
+            if surface is None:
+                surface = self.chunks[chunk] = self.render(chunk)
+            to_draw.append((surface, (chunk[0] * c + x, chunk[1] * c + y)))
+
+        screen.blits(to_draw, doreturn=False)
+
+        # Keep the chunks around the screen, so turning back does not render them again.
+        near = set(self.chunks_for(view.inflate(2 * self.margin * c, 2 * self.margin * c)))
+        for chunk in [chunk for chunk in self.chunks if chunk not in near]:
+            del self.chunks[chunk]
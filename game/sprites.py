@@ -1,12 +1,14 @@
 import pygame
 import json
+from array import array
 from util.setup import *
+from util.text_cache import get_font, render_text
+from util.assets import ASSETS
+from game.input import KEYBOARD
 from game.ui import HealthBar
 
 config = get_config()
 SIZE = config['size']
-SOUNDS = generate_eat_sound()
-BLOCK_IMAGES = generate_block_images()
 
 class Player(pygame.sprite.Sprite):
     '''
@@ -14,7 +16,7 @@ class Player(pygame.sprite.Sprite):
     '''
     def __init__(self, x, y, width, height, speed, accel, jump_accel, name=''):
         super().__init__()
-        self.IMAGES = generate_player_images()
+        self.IMAGES = ASSETS.get('player')
         self.rect = pygame.Rect(x, y, width, height)
         self.front = self.IMAGES['playerfront']
         self.left = self.IMAGES['playerleft']
@@ -35,10 +37,13 @@ class Player(pygame.sprite.Sprite):
         self.max_health = 200
 
         self.score = 0
-        self.score_font = pygame.font.SysFont('Calibri', 24, bold=True, italic=True)
-        self.name_font = pygame.font.SysFont('Courier', 16, bold=True)
+        self.score_font = get_font('Calibri', 24, bold=True, italic=True)
+        self.name_font = get_font('Courier', 16, bold=True)
 
         self.win = False
+        self.track_breaks = False # when set, the ids of broken blocks are collected in broken_blocks.
+        self.input = KEYBOARD # see game.input
+        self.broken_blocks = []
 
         self.extensions = {
             'up' : Extension(x+width//2, y+5),
@@ -69,10 +74,10 @@ class Player(pygame.sprite.Sprite):
             self.health_bar.draw(screen, self)
 
         if draw_score:
-            screen.blit(self.score_font.render(f'{self.name} Score:{self.score}', 1, (255, 23, 23)), score_location)
+            screen.blit(render_text(self.score_font, f'{self.name} Score:{self.score}', (255, 23, 23)), score_location)
 
         if name:
-            screen.blit(self.name_font.render(self.name, 1, (255, 0, 0)), (new_rect.x, new_rect.y - 20))
+            screen.blit(render_text(self.name_font, self.name, (255, 0, 0)), (new_rect.x, new_rect.y - 20))
         # Draw extension hitboxes
         #for value in self.extensions.values():
             #value.draw(screen, camera)
@@ -84,7 +89,7 @@ class Player(pygame.sprite.Sprite):
         dt = clock.get_time() / 30
 
         #### Keys
-        keys = pygame.key.get_pressed()
+        keys = self.input.pressed()
 
         if keys[pygame.K_LEFT]:
             self.speed = max(-self.max_speed, self.speed - self.accel)
@@ -147,7 +152,7 @@ class Player(pygame.sprite.Sprite):
         self.update_extensions()
         #print(self.rect.y)
     def events(self, events, blocks, camera):
-        keys = pygame.key.get_pressed()
+        keys = self.input.pressed()
 
         for event in events:
             if event.type == pygame.KEYDOWN:
@@ -179,34 +184,39 @@ class Player(pygame.sprite.Sprite):
         self.extensions['right'].rect.x, self.extensions['right'].rect.y = self.rect.x+self.rect.width, self.rect.y+self.rect.height//2
     
 
-    def check_collisions(self, group, check_x=True):
-        sprites_hit = pygame.sprite.spritecollide(self, group, False)
+    def check_collisions(self, blocks, check_x=True):
+        hit = blocks.collide(self.rect)
 
-        for sprite in sprites_hit:
+        for i in hit:
+            block = blocks.rect(i)
             if check_x:
                 if self.speed > 0:
-                    self.rect.right = sprite.rect.left 
+                    self.rect.right = block.left 
                 elif self.speed < 0:
-                    self.rect.left = sprite.rect.right
+                    self.rect.left = block.right
                 break
             else:
                 if self.speed_y > 0:
-                    self.rect.top = sprite.rect.bottom
+                    self.rect.top = block.bottom
                 elif self.speed_y < 0:
-                    self.rect.bottom = sprite.rect.top
+                    self.rect.bottom = block.top
                 
                 self.speed_y = 0
-                if self.rect.top != sprite.rect.bottom: 
+                if self.rect.top != block.bottom: 
                     self.is_jump = False
                 break
     
-    def check_block_break(self, group, direction):
-        sprites_hit = pygame.sprite.spritecollide(self.extensions[direction], group, False)
-
-        for sprite in sprites_hit:
-            if sprite.hit_interaction(self):
-                SOUNDS['munch'].play()
-                sprite.kill()
+    def check_block_break(self, blocks, direction):
+        hit = blocks.collide(self.extensions[direction].rect)
+
+        for i in hit:
+            if blocks.block(i).hit_interaction(self):
+                ASSETS.get('munch').play()
+                blocks.remove(i)
+                if self.track_breaks:
+                    self.broken_blocks.append(i)
+            else:
+                blocks.invalidate(i) # tough blocks change image on hit.
                 
 
 
@@ -227,73 +237,228 @@ class Extension(pygame.sprite.Sprite):
         screen.blit(self.surf, camera.apply_offset(self))
 
 
-class Block(pygame.sprite.Sprite):
+ALIVE = 1 # BlockStore flags
+GOD = 2 # can't be broken (see Index)
+
+
+class BlockStore:
+    '''
+    Holds the blocks of a level as a struct of arrays: grid column and row, type,
+    health, image and flags each live in one typed array, and a block is just
+    its index in them (this is also its id, see RaceMultiPlayer).
+    Blocks fill one grid cell each, so collisions are a cell lookup.
+    Collisions, breaks and drawing all work on indices; a Block object is only
+    made to run a hit (see block()).
+    A removed block's index is reused by add() once it is released
+    (endless mode releases rows as they scroll away).
+    '''
+    STRIDE = 65536 # cell key = row * STRIDE + column, columns must fit in +-32767
+
+    def __init__(self, size=100):
+        self.size = size # pixels per grid cell
+        self.column = array('i')
+        self.row = array('i')
+        self.type = array('b')
+        self.health = array('i')
+        self.image = array('H') # index into surfaces
+        self.flags = array('B')
+        self.cells = {} # cell key -> index of the block in that cell
+        self.surfaces = [] # image id -> Surface
+        self.image_ids = {} # Surface -> image id
+        self.spawn = {} # block type -> (health, image id) of a new block
+        self.free = [] # released indices, reused by add()
+        self.count = 0 # blocks alive
+        self.layers = [] # render caches to tell when a block changes (see game.render)
+        self.created = 0
+        self.reused = 0
+        self.released = 0
+
+    def __len__(self):
+        return self.count
+
+    def image_id(self, surface):
+        image = self.image_ids.get(surface)
+        if image is None:
+            image = self.image_ids[surface] = len(self.surfaces)
+            self.surfaces.append(surface)
+        return image
+
+    def add(self, b, column, row):
+        '''
+        Adds a new block of type b in the given grid cell. Returns its index.
+        '''
+        spawn = self.spawn.get(b)
+        if spawn is None:
+            spawn = self.spawn[b] = (BLOCK_TYPES[b].max_health, self.image_id(BLOCK_TYPES[b].spawn_image()))
+        health, image = spawn
+
+        if self.free:
+            i = self.free.pop()
+            self.column[i], self.row[i], self.type[i] = column, row, b
+            self.health[i], self.image[i], self.flags[i] = health, image, ALIVE
+            self.reused += 1
+        else:
+            i = len(self.type)
+            self.column.append(column)
+            self.row.append(row)
+            self.type.append(b)
+            self.health.append(health)
+            self.image.append(image)
+            self.flags.append(ALIVE)
+            self.created += 1
+
+        self.cells[row * self.STRIDE + column] = i
+        self.count += 1
+        self.invalidate(i)
+        return i
+
+    def is_alive(self, i):
+        return 0 <= i < len(self.flags) and self.flags[i] & ALIVE
+
+    def remove(self, i):
+        '''
+        Takes block i out of the level (eg. when it is broken).
+        '''
+        if not self.flags[i] & ALIVE:
+            return
+        self.flags[i] = 0
+        del self.cells[self.row[i] * self.STRIDE + self.column[i]]
+        self.count -= 1
+        self.invalidate(i)
+
+    def release(self, i):
+        '''
+        Removes block i if needed and lets add() reuse its index.
+        Only release blocks that nothing refers to anymore.
+        '''
+        self.remove(i)
+        self.free.append(i)
+        self.released += 1
+
+    def set_god(self):
+        '''
+        Makes every block unbreakable.
+        '''
+        self.flags = array('B', (f | GOD for f in self.flags))
+
+    def rect(self, i):
+        s = self.size
+        return pygame.Rect(self.column[i] * s, self.row[i] * s, s, s)
+
+    def block(self, i):
+        '''
+        Returns a Block for block i, to run its hit_interaction.
+        '''
+        return BLOCK_TYPES[self.type[i]](self, i)
+
+    def indices(self):
+        '''
+        Returns the indices of the blocks alive.
+        '''
+        return [i for i, f in enumerate(self.flags) if f & ALIVE]
+
+    def invalidate(self, i):
+        '''
+        Call when a block changes image, so cached renders of it get redrawn.
+        '''
+        if self.layers:
+            rect = self.rect(i)
+            for layer in self.layers:
+                layer.invalidate(rect)
+
+    def collide(self, rect):
+        '''
+        Returns the indices of the blocks colliding with rect, in index order
+        (for levels that is the order they were added in).
+        '''
+        if rect.width <= 0 or rect.height <= 0:
+            return []
+        s, cells, stride = self.size, self.cells, self.STRIDE
+        hit = []
+        for column in range(rect.left // s, (rect.right - 1) // s + 1):
+            for row in range(rect.top // s, (rect.bottom - 1) // s + 1):
+                i = cells.get(row * stride + column)
+                if i is not None:
+                    hit.append(i)
+        hit.sort()
+        return hit
+
+    def visible(self, camera):
+        '''
+        Returns the indices of the blocks on screen for the camera, in drawing order.
+        '''
+        return self.collide(camera.view())
+
+    def blit_sequence(self, rect, offset):
+        '''
+        Returns (image, position) of the blocks in rect moved by offset, for Surface.blits.
+        '''
+        s, x, y = self.size, offset[0], offset[1]
+        surfaces, image, column, row = self.surfaces, self.image, self.column, self.row
+        return [(surfaces[image[i]], (column[i] * s + x, row[i] * s + y)) for i in self.collide(rect)]
+
+    def stats(self):
+        return {'created' : self.created, 'reused' : self.reused, 'released' : self.released, 'free' : len(self.free)}
+
+
+class Block:
     '''
     Represents a block in the game.
+    The block's data lives in a BlockStore, this is a view on block id of
+    store (see BlockStore.block). Subclasses set the type, starting image
+    and health, and what happens when the player hits the block.
     '''
-    def __init__(self):
-        super().__init__()
-        self.IMAGES = BLOCK_IMAGES
-        self.health = 1
-        self.type = -111
-        self.god = False
+    type = -111
+    max_health = 1 # health of a new block
+    image_name = 'normal'
+
+    def __init__(self, store, id):
+        self.IMAGES = ASSETS.get('blocks')
+        self.store = store
+        self.id = id
 
     @classmethod
-    def construct_block_from_type(cls, b, x, y, width, height):
-        types = {
-            0 : StandardBlock,
-            1 : WinBlock,
-            99 : InvisBlock,
-            2 : ToughBlock,
-            3 : EnergyBlock,
-            4: ThornBlock,
-            5: SlowBlock,
-            6: FearBlock,
-            7: SuperBlock,
-            8: MushroomBlock,
-            9: SteelBlock,
-            10: RubyBlock
-        }
-        if b not in types.keys():
-            return None 
-        else:
-            return types.get(b)(x, y, width, height)
-        
-    
-    def draw_text(self, screen, camera, rendered_text):
-        r = camera.apply_offset(self)
-        screen.blit(rendered_text, (r.x, r.y - 20))
+    def spawn_image(cls):
+        image = ASSETS.get('blocks')[cls.image_name]
+        return image[0] if isinstance(image, list) else image
 
-    def draw(self, screen, camera):
-        pass
+    @property
+    def health(self):
+        return self.store.health[self.id]
+
+    @health.setter
+    def health(self, value):
+        self.store.health[self.id] = value
+
+    @property
+    def image(self):
+        return self.store.surfaces[self.store.image[self.id]]
+
+    @image.setter
+    def image(self, surface):
+        self.store.image[self.id] = self.store.image_id(surface)
+
+    @property
+    def god(self):
+        return bool(self.store.flags[self.id] & GOD)
 
-    def update(self):
-        pass
+    @property
+    def rect(self):
+        return self.store.rect(self.id)
 
-    def events(self, events):
-        pass
+    def hit_interaction(self, player):
+        return False
 
     def broken(self):
         return self.health == 0
-    
-    def check_position(self, camera):
-        return self.rect.y + self.rect.height < -camera.rect.y
 
 
 class StandardBlock(Block):
     '''
     The most common block in the game.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['normal']
-        self.relative_y = y
-        self.health = 1
-        self.type = 0
-    
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 0
+    image_name = 'normal'
     
     def hit_interaction(self, player):
         if not self.god:
@@ -311,16 +476,9 @@ class InvisBlock(Block):
     (Can be used to track the position of a row of blocks
     when it goes out of the scope of the camera.)
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['invis']
-        #self.image = pygame.Surface((100, 100))
-        self.health = 99999
-        self.type = 99
-        
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 99
+    max_health = 99999
+    image_name = 'invis'
     
     def hit_interaction(self, player):
         return False
@@ -329,15 +487,9 @@ class WinBlock(Block):
     '''
     Reach this block to win the game level.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['win']
-        self.health = 99999
-        self.type = 1
-    
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 1
+    max_health = 99999
+    image_name = 'win'
     
     def hit_interaction(self, player):
         if not self.god:
@@ -353,16 +505,9 @@ class ToughBlock(Block):
     required can be adjusted by changing the health,
     but there is only support for 3 in the sprite images so far.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['tough'][0]
-        self.max_health = 3
-        self.health = 3
-        self.type = 2
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 2
+    max_health = 3
+    image_name = 'tough'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -379,16 +524,8 @@ class EnergyBlock(Block):
     '''
     Restores energy when broken.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['energy']
-        self.max_health = 1
-        self.health = 1
-        self.type = 3
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 3
+    image_name = 'energy'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -403,16 +540,8 @@ class ThornBlock(Block):
     '''
     Does extra damage to player when hit.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['thorns']
-        self.max_health = 1
-        self.health = 1
-        self.type = 4
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 4
+    image_name = 'thorns'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -427,16 +556,9 @@ class SlowBlock(Block):
     '''
     Reduces the player's max speed for the current session.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['slow'][0]
-        self.max_health = 2
-        self.health = 2
-        self.type = 5
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 5
+    max_health = 2
+    image_name = 'slow'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -454,16 +576,8 @@ class FearBlock(Block):
     '''
     Scares the player and boosts jump for the current session.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['fear']
-        self.max_health = 1
-        self.health = 1
-        self.type = 6
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 6
+    image_name = 'fear'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -480,16 +594,8 @@ class SuperBlock(Block):
     Grants increased speed, health, max health, and increased hit range.
     May not extend hit range with another super block in the same stage.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['super']
-        self.max_health = 1
-        self.health = 1
-        self.type = 7
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 7
+    image_name = 'super'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -513,16 +619,8 @@ class MushroomBlock(Block):
     '''
     Makes the player bigger on hit.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['mushroom']
-        self.max_health = 1
-        self.health = 1
-        self.type = 8
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 8
+    image_name = 'mushroom'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -545,16 +643,9 @@ class SteelBlock(Block):
     Takes many hits to destroy and does more damage on hit than normal.
     Not suggested to try to break.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['steel'][0]
-        self.max_health = 8
-        self.health = 8
-        self.type = 9
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 9
+    max_health = 8
+    image_name = 'steel'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -571,16 +662,8 @@ class RubyBlock(Block):
     '''
     Gives lots of points, increases max health and restores health.
     '''
-    def __init__(self, x, y, width, height):
-        super().__init__()
-        self.rect = pygame.Rect(x, y, width, height)
-        self.image = self.IMAGES['ruby']
-        self.max_health = 1
-        self.health = 1
-        self.type = 10
-
-    def draw(self, screen, camera):
-        screen.blit(self.image, camera.apply_offset(self))
+    type = 10
+    image_name = 'ruby'
 
     def hit_interaction(self, player):
         if not self.god:
@@ -596,3 +679,11 @@ class RubyBlock(Block):
     
 
     
+
+
+BLOCK_TYPES = {
+    block.type : block for block in [
+        StandardBlock, WinBlock, InvisBlock, ToughBlock, EnergyBlock, ThornBlock,
+        SlowBlock, FearBlock, SuperBlock, MushroomBlock, SteelBlock, RubyBlock
+    ]
+}
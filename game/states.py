@@ -6,19 +6,26 @@ from game.ui import Button, Tab, TabGroup, TextBox
 from game.sprites import *
 from game.camera import *
 from game.level_constructor import *
+from game.render import BlockRenderer, LayerCache
+from util.text_cache import get_font, render_text
 from server.game_server import *
-from util.setup import get_path, get_config, generate_menu_sounds, generate_level_thumbnails
+from server.rooms import DEFAULT_ROOM
+from util.setup import get_path, get_config
+from util.assets import ASSETS
 from multiprocessing.connection import Listener, Client
 
 
 c = get_config()
 SIZE = c['size']
-SOUNDS = generate_menu_sounds()
 
 class State():
     '''
     Base class for a state of the game.
     '''
+    # Gameplay states run update_objects in fixed physics steps (see StateManager.update).
+    # The others (menus, and states that wait on the network) run it once per frame.
+    fixed_step = False
+
     def __init__(self, name='', images={}):
         self.name = name
         self.IMAGES = images
@@ -38,6 +45,12 @@ class State():
 
     def handle_events(self, events):
         raise NotImplementedError
+
+    def moving(self):
+        '''
+        Objects (with a rect) whose drawn position is interpolated between physics steps.
+        '''
+        return []
     
     @staticmethod
     def make_endless_single(images, level=None):
@@ -47,21 +60,92 @@ class State():
     def make_level_single(images, level=0):
         return LevelSingle(images=images, level=level)
 
+class FixedStep():
+    '''
+    Stands in for the pygame Clock during one fixed physics step.
+    '''
+    def __init__(self, ms):
+        self.ms = ms
+
+    def get_time(self):
+        return self.ms
+
 class StateManager():
     '''
     Manages switching between the different states of the game.
     Initially begins at the main menu.
+
+    Game time advances in fixed steps (see update), so physics
+    does not depend on the frame rate.
     '''
-    def __init__(self, images, volume, music):
+    STEP = 1000 / 60 # ms of game time per update_objects call.
+    MAX_STEPS = 5 # per frame. Past that the game slows down instead of falling further behind.
+
+    def __init__(self, images, volume, music, headless=False):
+        self.headless = headless # no display or player watching (see headless.py).
+        self.step_clock = FixedStep(self.STEP)
+        self.accumulator = 0 # ms of real time not simulated yet.
+        self.previous = {} # object -> rect position before the last step.
+        self.alpha = 0
         self.switch(Menu(images=images))
         self.volume = volume # Volume for the global music played across all states.
         self.music = music
 
+    def update(self, clock):
+        '''
+        Runs as many fixed steps of update_objects as the time since the last frame covers.
+        States without fixed_step are updated once with the frame's clock.
+        Returns the number of steps run.
+        '''
+        if not self.state.fixed_step:
+            self.accumulator = 0
+            self.alpha = 0
+            self.state.update_objects(clock)
+            return 1
+
+        self.accumulator += clock.get_time()
+        steps = 0
+        while self.accumulator >= self.STEP:
+            if steps == self.MAX_STEPS:
+                self.accumulator = 0
+                break
+            self.previous = {obj : obj.rect.topleft for obj in self.state.moving()}
+            self.state.update_objects(self.step_clock)
+            self.accumulator -= self.STEP
+            steps += 1
+
+        self.alpha = self.accumulator / self.STEP
+        return steps
+
+    def draw(self, screen):
+        '''
+        Draws the state with moving objects placed between their last two physics steps.
+        '''
+        moved = []
+        for obj in self.state.moving():
+            if obj in self.previous:
+                (x, y), current = self.previous[obj], obj.rect.topleft
+                obj.rect.topleft = (round(x + (current[0] - x) * self.alpha), round(y + (current[1] - y) * self.alpha))
+                moved.append((obj, current))
+
+        self.state.draw_screen(screen)
+
+        for obj, position in moved:
+            obj.rect.topleft = position
+
     def switch(self, state):
         self.state = state
+        self.previous = {}
         self.state.manager = self # assign the manager to the state itself.
         print(f'[Game] On state {self.state}')
 
+    def pause(self, ms):
+        '''
+        Holds the current frame on screen for a while (eg. game over), unless headless.
+        '''
+        if not self.headless:
+            pygame.time.wait(ms)
+
 ##########################################################################
 
 class Menu(State):
@@ -71,8 +155,8 @@ class Menu(State):
     def __init__(self, name='Main Menu', images={}):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['menu']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
-        self.button_font = pygame.font.SysFont('Calibri', 32)
+        self.title_font = get_font('Calibri', 64)
+        self.button_font = get_font('Calibri', 32)
         self.title = self.title_font.render('Block Muncher', True, (218, 242, 245))
         self.title_size = self.title.get_size()
 
@@ -122,19 +206,19 @@ class Help(State):
     '''
     def __init__(self, name='Settings', images={}):
         super().__init__(name=name, images=images)
-        self.title_font = pygame.font.SysFont('Calibri', 64)
+        self.title_font = get_font('Calibri', 64)
         self.title = self.title_font.render('How to Play', True, (218, 242, 245))
         self.title_size = self.title.get_size()
 
-        self.help_text0 = pygame.font.SysFont('Arial', 24, bold=True).render(
+        self.help_text0 = get_font('Arial', 24, bold=True).render(
             'Welcome to Block Muncher.',
             True, (0, 0, 0)
         )
-        self.help_text1 = pygame.font.SysFont('Arial', 24, bold=True).render(
+        self.help_text1 = get_font('Arial', 24, bold=True).render(
             'Use the arrow keys to move and ESC to pause.',
             True, (0, 0, 0)
         )
-        self.help_text2 = pygame.font.SysFont('Arial', 24, bold=True).render(
+        self.help_text2 = get_font('Arial', 24, bold=True).render(
             'Press space while holding one of the arrow keys to break blocks!',
             True, (0, 0, 0)
         )
@@ -174,7 +258,7 @@ class Settings(State):
     '''
     def __init__(self, name='Settings', images={}):
         super().__init__(name=name, images=images)
-        self.title_font = pygame.font.SysFont('Calibri', 64)
+        self.title_font = get_font('Calibri', 64)
         self.title = self.title_font.render('Settings', True, (218, 242, 245))
         self.title_size = self.title.get_size()
         c = get_config()
@@ -228,21 +312,11 @@ class Settings(State):
             self.fps = fps_switch[self.fps]
             print(f'[Game] fps changed to {self.fps}')
 
-            with open(get_path('config.json'), 'r+') as f:
-                config = json.load(f)
-                config['fps'] = self.fps
-                f.seek(0)
-                json.dump(config, f)
-                f.truncate()
+            get_config().set('fps', self.fps)
         
         if self.camera_button.check_click(events):
-            with open(get_path('config.json'), 'r+') as f:
-                config = json.load(f)
-                self.experimental_cam = int(not config['experimental_camera'])
-                config['experimental_camera'] = self.experimental_cam
-                f.seek(0)
-                json.dump(config, f)
-                f.truncate()
+            self.experimental_cam = int(not get_config()['experimental_camera'])
+            get_config().set('experimental_camera', self.experimental_cam)
             print(f'[Game] Toggled experimental cameras')
         
 
@@ -257,12 +331,7 @@ class Settings(State):
             self.manager.volume = volume_switch[self.manager.volume]
             print(f'[Game] music volume changed to {self.manager.volume}')
 
-            with open(get_path('config.json'), 'r+') as f:
-                config = json.load(f)
-                config['volume'] = self.manager.volume
-                f.seek(0)
-                json.dump(config, f)
-                f.truncate()
+            get_config().set('volume', self.manager.volume)
 
         
 
@@ -275,11 +344,11 @@ class Paused(State):
     '''
     def __init__(self, name='Pause menu', images={}, state=None, from_index=False):
         super().__init__(name=name, images=images)
-        SOUNDS['pause'].play()
+        ASSETS.get('pause').play()
         
         self.image = self.IMAGES['pause']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
-        self.button_font = pygame.font.SysFont('Calibri', 32)
+        self.title_font = get_font('Calibri', 64)
+        self.button_font = get_font('Calibri', 32)
         self.title = self.title_font.render('Paused', True, (218, 242, 245))
         self.title_size = self.title.get_size()
         self.from_index = from_index
@@ -323,8 +392,8 @@ class GameOver(State):
     def __init__(self, name='Game over menu', images={}, prev_game='', player=None, level=0):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['pause']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
-        self.button_font = pygame.font.SysFont('Calibri', 32)
+        self.title_font = get_font('Calibri', 64)
+        self.button_font = get_font('Calibri', 32)
         self.title = self.title_font.render('Game Over', True, (241, 0, 50))
         self.title_size = self.title.get_size()
         self.level = level
@@ -350,7 +419,7 @@ class GameOver(State):
         for b in self.buttons:
             b.draw(screen)
         
-        screen.blit(self.player.score_font.render(f'Final score:{self.player.score}', 1, (255, 23, 23)), (SIZE[0]//2-125, 125))
+        screen.blit(render_text(self.player.score_font, f'Final score:{self.player.score}', (255, 23, 23)), (SIZE[0]//2-125, 125))
         screen.blit(self.player.front, (150, 300))
 
     def update_objects(self, clock):
@@ -371,8 +440,8 @@ class Win(State):
     def __init__(self, name='Win menu', images={}, prev_game='', player=None, level=0):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['pause']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
-        self.button_font = pygame.font.SysFont('Calibri', 32)
+        self.title_font = get_font('Calibri', 64)
+        self.button_font = get_font('Calibri', 32)
         self.title = self.title_font.render('Win!', True, (241, 0, 50))
         self.title_size = self.title.get_size()
         self.level = level
@@ -397,7 +466,7 @@ class Win(State):
         for b in self.buttons:
             b.draw(screen)
         
-        screen.blit(self.player.score_font.render(f'Final score:{self.player.score}', 1, (255, 23, 23)), (SIZE[0]//2-125, 125))
+        screen.blit(render_text(self.player.score_font, f'Final score:{self.player.score}', (255, 23, 23)), (SIZE[0]//2-125, 125))
         screen.blit(self.player.front, (150, 300))
 
     def update_objects(self, clock):
@@ -418,7 +487,7 @@ class PlayMenu(State):
     def __init__(self, name='Play Menu', images={}):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['menu']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
+        self.title_font = get_font('Calibri', 64)
         self.title = self.title_font.render('Play', True, (218, 242, 245))
         self.title_size = self.title.get_size()
 
@@ -469,10 +538,10 @@ class LevelSelect(State):
     def __init__(self, name='Level Select', images={}):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['menu']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
+        self.title_font = get_font('Calibri', 64)
         self.title = self.title_font.render('Level Select', True, (218, 242, 245))
         self.title_size = self.title.get_size()
-        self.thumbnails = generate_level_thumbnails()
+        self.thumbnails = ASSETS.get('thumbnails')
 
         self.back_button = Button(SIZE[0]//2 - 70, 500, 140, 50, 'Back', 'Calibri', 32,
          (66, 227, 245), (161, 232, 240))
@@ -546,6 +615,8 @@ class SinglePlayerGame(State):
     '''
     Represents an instance of a single player game.
     '''
+    fixed_step = True
+
     def __init__(self, name=None, images={}):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['game']
@@ -565,27 +636,30 @@ class SinglePlayerGame(State):
     def handle_events(self, events):
         pass
 
+    def moving(self):
+        return [self.player, self.camera]
+
 
 class EndlessSingle(SinglePlayerGame):
     '''
     Represents the endless mode in single player.
     '''
-    def __init__(self, name='Endless single player', images={}):
+    def __init__(self, name='Endless single player', images={}, seed=None):
         super().__init__(name=name, images=images)
         self.blocks = pygame.sprite.Group()
-        self.level_constructor = LevelConstructor.get_endless()
+        self.level_constructor = LevelConstructor.get_endless(seed)
         self.blocks = self.level_constructor.get_random_chunk()
 
         self.ground = self.level_constructor.ground_level
 
         self.camera = Camera(simple_camera_follow_auto_up, SIZE[0], SIZE[1], True, self.ground)
-        self.time = pygame.time.get_ticks()
+        self.time = 0 # ms of game time since the camera last sped up.
+        self.renderer = BlockRenderer(self.blocks)
 
     def draw_screen(self, screen):
         screen.blit(self.image, (0, 0))
 
-        for block in self.blocks:
-            block.draw(screen, self.camera)
+        self.renderer.draw(screen, self.camera)
 
         self.player.draw(screen, self.camera)
     
@@ -595,8 +669,9 @@ class EndlessSingle(SinglePlayerGame):
 
         self.blocks = self.level_constructor.update_block_chunks(self.camera)
         
-        if pygame.time.get_ticks() - self.time >= 15 * 1000: # Every so seconds
-            self.time = pygame.time.get_ticks()
+        self.time += clock.get_time()
+        if self.time >= 15 * 1000: # Every so seconds
+            self.time = 0
             self.camera.increment += 0.75 # adjust camera up speed
         
         
@@ -604,8 +679,8 @@ class EndlessSingle(SinglePlayerGame):
     def handle_events(self, events):
         if self.player.events(events, self.blocks, self.camera):
             self.manager.music.stop()
-            SOUNDS['gameover'].play()
-            pygame.time.wait(3000)
+            ASSETS.get('gameover').play()
+            self.manager.pause(3000)
             self.manager.music.play(-1)
             self.manager.switch(GameOver(images=self.IMAGES, prev_game='endless-single', player=self.player))
 
@@ -636,14 +711,14 @@ class LevelSingle(SinglePlayerGame):
 
         self.camera = Camera(self.camera_f, SIZE[0], SIZE[1], True, self.ground)
         self.time = pygame.time.get_ticks()
+        self.renderer = LayerCache(self.blocks, self.level_constructor.chunk_size)
 
         print('starting level', self.level, 'with ground', self.ground)
 
     def draw_screen(self, screen):
         screen.blit(self.image, (0, 0))
 
-        for block in self.blocks:
-            block.draw(screen, self.camera)
+        self.renderer.draw(screen, self.camera)
 
         self.player.draw(screen, self.camera)
         self.restart_button.draw(screen)
@@ -655,8 +730,8 @@ class LevelSingle(SinglePlayerGame):
     def handle_events(self, events):
         if self.player.events(events, self.blocks, self.camera):
             self.manager.music.stop()
-            SOUNDS['gameover'].play()
-            pygame.time.wait(3000)
+            ASSETS.get('gameover').play()
+            self.manager.pause(3000)
             self.manager.music.play(-1)
             self.manager.switch(GameOver(images=self.IMAGES, prev_game='level-single', player=self.player, level=self.level))
 
@@ -684,20 +759,22 @@ class Index(SinglePlayerGame):
         self.level_constructor = LevelConstructor.get_level(self.level)
         self.blocks = self.level_constructor.blocks
         self.ground = self.level_constructor.ground_level
-        self.font = pygame.font.SysFont('Calibri', 28, bold=True)
-
-        self.index_blocks = [
-            [StandardBlock(100, 200, 100, 100), self.font.render('Normal Block', True, (51, 204, 204))],
-            [WinBlock(600, 400, 100, 100), self.font.render('Win Block', True, (51, 204, 204))],
-            [ToughBlock(100, 600, 100, 100), self.font.render('Tough Block', True, (51, 204, 204))],
-            [EnergyBlock(600, 800, 100, 100), self.font.render('Restores health!', True, (51, 204, 204))],
-            [ThornBlock(100, 1000, 100, 100), self.font.render('Thorny-does more damage', True, (51, 204, 204))],
-            [SlowBlock(600, 1200, 100, 100), self.font.render('Slow block', True, (51, 204, 204))],
-            [FearBlock(100, 1400, 100, 100), self.font.render('Scary-increases jump', True, (51, 204, 204))],
-            [SuperBlock(600, 1600, 100, 100), self.font.render('SuperMan-more range,speed,hp', True, (51, 204, 204))],
-            [MushroomBlock(100, 1800, 100, 100), self.font.render('Makes you big', True, (51, 204, 204))],
-            [SteelBlock(600, 2000, 100, 100), self.font.render('Hard to break!', True, (51, 204, 204))],
-            [RubyBlock(100, 2000, 100, 100), self.font.render('Max hp+ and restores hp', True, (51, 204, 204))]
+        self.font = get_font('Calibri', 28, bold=True)
+
+        # Shown with their names, but not part of the level (can't be hit).
+        self.index_blocks = BlockStore()
+        self.labels = [
+            [self.index_blocks.add(StandardBlock.type, 1, 2), self.font.render('Normal Block', True, (51, 204, 204))],
+            [self.index_blocks.add(WinBlock.type, 6, 4), self.font.render('Win Block', True, (51, 204, 204))],
+            [self.index_blocks.add(ToughBlock.type, 1, 6), self.font.render('Tough Block', True, (51, 204, 204))],
+            [self.index_blocks.add(EnergyBlock.type, 6, 8), self.font.render('Restores health!', True, (51, 204, 204))],
+            [self.index_blocks.add(ThornBlock.type, 1, 10), self.font.render('Thorny-does more damage', True, (51, 204, 204))],
+            [self.index_blocks.add(SlowBlock.type, 6, 12), self.font.render('Slow block', True, (51, 204, 204))],
+            [self.index_blocks.add(FearBlock.type, 1, 14), self.font.render('Scary-increases jump', True, (51, 204, 204))],
+            [self.index_blocks.add(SuperBlock.type, 6, 16), self.font.render('SuperMan-more range,speed,hp', True, (51, 204, 204))],
+            [self.index_blocks.add(MushroomBlock.type, 1, 18), self.font.render('Makes you big', True, (51, 204, 204))],
+            [self.index_blocks.add(SteelBlock.type, 6, 20), self.font.render('Hard to break!', True, (51, 204, 204))],
+            [self.index_blocks.add(RubyBlock.type, 1, 20), self.font.render('Max hp+ and restores hp', True, (51, 204, 204))]
         ]
 
         c = get_config()
@@ -708,21 +785,20 @@ class Index(SinglePlayerGame):
 
         self.camera = Camera(self.camera_f, SIZE[0], SIZE[1], True, self.ground)
         self.time = pygame.time.get_ticks()
+        self.renderer = BlockRenderer(self.blocks)
+        self.index_renderer = BlockRenderer(self.index_blocks)
 
-        for b in self.blocks:
-            b.god = True
+        self.blocks.set_god()
 
     def draw_screen(self, screen):
         screen.blit(self.image, (0, 0))
 
-        for block in self.blocks:
-            block.draw(screen, self.camera)
+        self.renderer.draw(screen, self.camera)
         
-        for l in self.index_blocks:
-            block = l[0]
-            text = l[1]
-            block.draw(screen, self.camera)
-            block.draw_text(screen, self.camera, text)
+        self.index_renderer.draw(screen, self.camera)
+        for block, text in self.labels:
+            r = self.index_blocks.rect(block).move(self.camera.rect.topleft)
+            screen.blit(text, (r.x, r.y - 20))
 
         self.player.draw(screen, self.camera)
     
@@ -746,8 +822,8 @@ class MultiPlayerMenu(State):
     def __init__(self, name='Multiplayer menu', images={}, client=None, server=None, id=-1):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['menu']
-        self.title_font = pygame.font.SysFont('Calibri', 64)
-        self.button_font = pygame.font.SysFont('Calibri', 32)
+        self.title_font = get_font('Calibri', 64)
+        self.button_font = get_font('Calibri', 32)
         self.title = self.title_font.render('Multiplayer (1v1)', True, (218, 242, 245))
         self.title_size = self.title.get_size()
         self.mode = True
@@ -770,7 +846,7 @@ class MultiPlayerMenu(State):
             self.back_button
         ]
 
-        self.instructions = 'Enter {ip}:{port} right here. Then click the host/connect buttons.'
+        self.instructions = 'Enter {ip}:{port}/{room} right here (room is optional). Then click the host/connect buttons.'
         self.text_box = TextBox(SIZE[0]//2 - 35, 200, 70, 40, self.instructions)
         self.name_box = TextBox(SIZE[0]//2 - 35, 150, 70, 40, 'Type name here (max 12 chars).')
         self.status_box = TextBox(500, 300, 250, 40, 'This will show connected players')
@@ -778,7 +854,7 @@ class MultiPlayerMenu(State):
 
         self.status_box.enable_write = False
         self.quit_box.enable_write = False
-        self.quit_box.font = pygame.font.SysFont('Calibri', 12)
+        self.quit_box.font = get_font('Calibri', 12)
 
         self.draw_quit_box = False
 
@@ -811,6 +887,20 @@ class MultiPlayerMenu(State):
         except Exception as e:
             print(e)
 
+    def join_room(self, room):
+        '''
+        Joins the room on the server, creating it if it doesn't exist yet.
+        '''
+        reply = self.client.join_room(room)
+        if reply['error'] == 'No such room':
+            reply = self.client.create_room(room, self.mode)
+
+        if reply['error']:
+            self.status_box.text = reply['error']
+            self.active_client = False
+        else:
+            print('[Game] Joined room', reply['room'])
+
     def draw_screen(self, screen):
         screen.blit(self.image, (0, 0))
         screen.blit(self.title, (SIZE[0]//2 - self.title_size[0]//2, 50))
@@ -869,7 +959,7 @@ class MultiPlayerMenu(State):
                     except TypeError:
                         self.status_box.text = ' | '.join([name for name in self.players_in_room.values()])
             except Exception as e:
-                self.status_box.font = pygame.font.SysFont('Courier', 14)
+                self.status_box.font = get_font('Courier', 14)
                 self.status_box.text = '[ERROR] Connection to server interrupted'
                 self.full = False
                 print(e)
@@ -890,11 +980,13 @@ class MultiPlayerMenu(State):
         if self.connect_button.check_click(events):
             if not self.active_client:
                 if self.text_box.text:
-                    data = self.text_box.text.strip().split(':')
+                    address, _, room = self.text_box.text.strip().partition('/')
+                    data = address.split(':')
                     try:
                         data[0] = '127.0.0.1' if not data[0] else data[0]
                         self.client = GClient(ip=data[0], port=int(data[1]))
                         self.connect_client()
+                        self.join_room(room or DEFAULT_ROOM)
 
                         self.name_box.enable_write = False
                         print('[Game] Connected to', data[0])
@@ -908,7 +1000,7 @@ class MultiPlayerMenu(State):
         if self.host_button.check_click(events):
             if not self.active_server:
                 if self.text_box.text:
-                    data = self.text_box.text.strip().split(':')
+                    data = self.text_box.text.strip().partition('/')[0].split(':')
                     try:
                         self.server = GServer(ip=data[0], port=int(data[1]))
                         self.host()
@@ -950,7 +1042,21 @@ class MultiPlayerMenu(State):
         else:
             self.draw_quit_box = False
 
-class RaceMultiPlayer(State):
+class MultiPlayerGame(State):
+    '''
+    Base class for the multiplayer in-game states.
+    They talk to the server through self.worker, a NetworkWorker on self.client.
+    '''
+    fixed_step = True
+
+    def leave(self):
+        '''
+        Stops the network worker and goes back to the multiplayer menu.
+        '''
+        self.worker.stop()
+        self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+
+class RaceMultiPlayer(MultiPlayerGame):
     '''
     Represents the race multiplayer in-game state.
     '''
@@ -970,9 +1076,9 @@ class RaceMultiPlayer(State):
         self.to_send = {
             'type' : 'ingame-race',
             'setup' : True,
-            'init-blocks' : False,
             'player' : None,
-            'blocks' : set(),
+            'breaks' : [],
+            'break-ack' : 0,
             'quit' : False,
             'win' : False
         }
@@ -986,6 +1092,11 @@ class RaceMultiPlayer(State):
 
         kwargs = self.server_reply['players-race'][self.server_reply['p2']]
         self.player2 = Player(**kwargs)
+
+        if self.id == self.server_reply['p1']:
+            self.player.track_breaks = True
+        else:
+            self.player2.track_breaks = True
         
         self.to_send['player'] = {'x': self.player.rect.x, 'y': self.player.rect.y}
         
@@ -994,7 +1105,9 @@ class RaceMultiPlayer(State):
         self.blocks = self.level_constructor.blocks
         self.ground = self.level_constructor.ground_level
 
-        self.alive_blocks = set([(b.rect.x, b.rect.y) for b in self.blocks.sprites()])
+        # Block breaks are shared through the server's break log (see apply_breaks).
+        self.pending_breaks = set() # broken here, not in the break log yet.
+        self.break_seq = 0 # last break log entry applied.
 
         self.time = pygame.time.get_ticks()
 
@@ -1002,11 +1115,14 @@ class RaceMultiPlayer(State):
 
         print('[Game] Sent multiplayer_race setup request', self.to_send, 'on', self.id)
         pygame.time.wait(1000) # sleep 1 second to let server settle
-        self.send_initial_blocks()
 
-        self.player.score_font = pygame.font.SysFont('Calibri', 18, bold=True, italic=True)
-        self.player2.score_font = pygame.font.SysFont('Calibri', 18, bold=True, italic=True)
-        self.end_font = pygame.font.SysFont('Calibri', 72, bold=True, italic=True)
+        # From here on the network runs in the background (see NetworkWorker).
+        self.server_reply = self.client.update(self.to_send)
+        self.worker = NetworkWorker(self.client, self.to_send, self.server_reply)
+
+        self.player.score_font = get_font('Calibri', 18, bold=True, italic=True)
+        self.player2.score_font = get_font('Calibri', 18, bold=True, italic=True)
+        self.end_font = get_font('Calibri', 72, bold=True, italic=True)
         
 
         self.quit_button = Button(50, 20, 80, 50, text='ABORT_GAME', size=14, color=(200, 150, 0), alt_color=(255, 255, 150))
@@ -1018,60 +1134,68 @@ class RaceMultiPlayer(State):
             self.camera_f = simple_camera_follow_center
 
         self.camera = Camera(self.camera_f, SIZE[0], SIZE[1], True, self.ground)
+        self.renderer = LayerCache(self.blocks, self.level_constructor.chunk_size)
         
-    def send_initial_blocks(self):
-        self.to_send['init-blocks'] = True
-        self.to_send['blocks'].update(self.alive_blocks)
-        
-        self.server_reply = self.client.update(self.to_send)
-
-        self.to_send['init-blocks'] = False
-
     def draw_screen(self, screen):
         screen.blit(self.image, (0, 0))
 
-        for b in self.blocks:
-            b.draw(screen, self.camera)
+        self.renderer.draw(screen, self.camera)
 
         if self.id == self.server_reply['p1']:
             self.player.draw(screen, self.camera, name=True, score_location=(SIZE[0]-200, 45), draw_score=False, draw_health=False)
             self.player2.draw(screen, self.camera, name=True, score_location=(SIZE[0]-200, 60), draw_health=False, draw_score=False)
             if self.player.win:
-                screen.blit(self.end_font.render('You win', 1, (0, 255,0)), (300, 300))
+                screen.blit(render_text(self.end_font, 'You win', (0, 255,0)), (300, 300))
                 pygame.display.update()
-                pygame.time.wait(3000)
-                self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+                self.manager.pause(3000)
+                self.leave()
             if self.player2.win:
-                screen.blit(self.end_font.render('You lose', 1, (255, 0, 0)), (300, 300))
+                screen.blit(render_text(self.end_font, 'You lose', (255, 0, 0)), (300, 300))
                 pygame.display.update()
-                pygame.time.wait(3000)
-                self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+                self.manager.pause(3000)
+                self.leave()
         else:
             self.player.draw(screen, self.camera, name=True, score_location=(SIZE[0]-200, 45), draw_health=False, draw_score=False)
             self.player2.draw(screen, self.camera, name=True, score_location=(SIZE[0]-200, 60), draw_score=False, draw_health=False)
             if self.player.win:
-                screen.blit(self.end_font.render('You lose', 1, (255, 0,0)), (300, 300))
+                screen.blit(render_text(self.end_font, 'You lose', (255, 0,0)), (300, 300))
                 pygame.display.update()
-                pygame.time.wait(3000)
-                self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+                self.manager.pause(3000)
+                self.leave()
             if self.player2.win:
-                screen.blit(self.end_font.render('You win', 1, (0, 255, 0)), (300, 300))
+                screen.blit(render_text(self.end_font, 'You win', (0, 255, 0)), (300, 300))
                 pygame.display.update()
-                pygame.time.wait(3000)
-                self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+                self.manager.pause(3000)
+                self.leave()
         
         self.quit_button.draw(screen)
 
         
             
-    def update_alive_blocks(self):
-        for block in self.blocks:
-            if (block.rect.x, block.rect.y) not in self.alive_blocks:
-                block.kill()
-        
-        #print('blocks:', len(self.blocks), 'alive:', len(self.alive_blocks))
-                
-        self.alive_blocks = {(b.rect.x, b.rect.y) for b in self.blocks}
+    def moving(self):
+        return [self.player, self.player2, self.camera]
+
+    def record_breaks(self, player):
+        '''
+        Queues the blocks broken locally. They are resent until they show up in the break log.
+        '''
+        self.pending_breaks.update(player.broken_blocks)
+        player.broken_blocks.clear()
+
+        self.to_send['breaks'] = list(self.pending_breaks)
+        self.to_send['break-ack'] = self.break_seq
+
+    def apply_breaks(self):
+        '''
+        Applies the break log entries in the server reply that haven't been applied yet.
+        '''
+        start, ids = self.server_reply['breaks']
+        for seq, block_id in enumerate(ids, start + 1):
+            if seq > self.break_seq:
+                if self.blocks.is_alive(block_id):
+                    self.blocks.remove(block_id)
+                self.pending_breaks.discard(block_id)
+                self.break_seq = seq
         
 
     def update_objects(self, clock):
@@ -1080,19 +1204,18 @@ class RaceMultiPlayer(State):
         if self.id == self.server_reply['p1']:
             self.player.update(clock, self.ground, self.gravity, self.deccel, self.blocks, move_x_limit_right=400)
             
-            self.update_alive_blocks()
+            self.record_breaks(self.player)
 
             self.to_send['player'] = {'x': self.player.rect.x, 'y': self.player.rect.y}
             self.to_send['win'] = self.player.win
-            self.to_send['blocks'] = self.alive_blocks
 
-            self.server_reply = self.client.update(self.to_send)
+            self.worker.post(self.to_send)
+            self.server_reply = self.worker.latest()
+            self.apply_breaks()
 
             self.player2.rect.x = self.server_reply['players-race'][self.server_reply['p2']]['x']
             self.player2.rect.y = self.server_reply['players-race'][self.server_reply['p2']]['y']
             self.player2.win = self.server_reply['win'][self.server_reply['p2']]
-
-            self.alive_blocks = self.server_reply['blocks']
             
             self.camera.update_camera(self.player, clock)
             
@@ -1100,47 +1223,53 @@ class RaceMultiPlayer(State):
         else:
             self.player2.update(clock, self.ground, self.gravity, self.deccel, self.blocks, move_x_limit_right=400)
             
-            self.update_alive_blocks()
+            self.record_breaks(self.player2)
 
             self.to_send['player'] = {'x': self.player2.rect.x, 'y': self.player2.rect.y}
             self.to_send['win'] = self.player2.win
-            self.to_send['blocks'] = self.alive_blocks
 
-            self.server_reply = self.client.update(self.to_send)
+            self.worker.post(self.to_send)
+            self.server_reply = self.worker.latest()
+            self.apply_breaks()
 
             self.player.rect.x = self.server_reply['players-race'][self.server_reply['p1']]['x']
             self.player.rect.y = self.server_reply['players-race'][self.server_reply['p1']]['y']
             self.player.win = self.server_reply['win'][self.server_reply['p1']]
-
-            self.alive_blocks = self.server_reply['blocks']
             
             self.camera.update_camera(self.player2, clock)  
 
     def handle_events(self, events):
         #print(self.server_reply['quit'])
-        self.server_reply = self.client.update(self.to_send)
+        self.server_reply = self.worker.latest()
+        if not self.worker.connected:
+            self.leave()
+            return
+
         # events handled only for the player you are controlling.
         if self.id == self.server_reply['p1']:
             self.player.events(events, self.blocks, self.camera)
             if sum(self.server_reply['quit'].values()) > 0 or self.quit_button.check_click(events):
                 self.to_send['quit'] = True
+                self.worker.stop()
                 self.client.update(self.to_send)
 
-                self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+                self.leave()
         else:
             self.player2.events(events, self.blocks, self.camera)
             if sum(self.server_reply['quit'].values()) > 0 or self.quit_button.check_click(events):
                 self.to_send['quit'] = True
+                self.worker.stop()
                 self.client.update(self.to_send)
 
-                self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+                self.leave()
         
         
 
-class EndlessMultiPlayer(State):
+class EndlessMultiPlayer(MultiPlayerGame):
     '''
     Represents the multiplayer in-game state.
     '''
+
     def __init__(self, name='Endless multi player', images={}, client=None, server=None, id=-1):
         super().__init__(name=name, images=images)
         self.image = self.IMAGES['game']
@@ -1155,7 +1284,8 @@ class EndlessMultiPlayer(State):
         self.ground = self.level_constructor.ground_level
 
         self.camera = Camera(simple_camera_follow_auto_up, SIZE[0], SIZE[1], True, self.ground)
-        self.time = pygame.time.get_ticks()
+        self.time = 0 # ms of game time since the camera last sped up.
+        self.renderer = BlockRenderer(self.blocks)
 
         self.client = client
         self.server = server
@@ -1173,21 +1303,21 @@ class EndlessMultiPlayer(State):
         self.opponent_score = 0
         self.opponent_lost = False
         self.opponent_name = ''
-        self.height_font = pygame.font.SysFont('Courier', 12)
-        self.end_font = pygame.font.SysFont('Calibri', 72, bold=True, italic=True)
+        self.height_font = get_font('Courier', 12)
+        self.end_font = get_font('Calibri', 72, bold=True, italic=True)
 
         self.server_reply = self.client.update(self.to_send)
+        self.worker = NetworkWorker(self.client, self.to_send, self.server_reply)
 
     def draw_screen(self, screen):
         screen.blit(self.image, (0, 0))
 
-        for block in self.blocks:
-            block.draw(screen, self.camera)
+        self.renderer.draw(screen, self.camera)
 
         self.player.draw(screen, self.camera, draw_score=False)
         
         y = self.opponent_y if type(self.opponent_y)==int else 0
-        opponent_box = self.height_font.render(f'{self.opponent_name}:{y}', 1, (0,0,0))
+        opponent_box = render_text(self.height_font, f'{self.opponent_name}:{y}', (0,0,0))
         opponent_box_size = opponent_box.get_size()
 
         #y_opponent_box = min(SIZE[1] - opponent_box_size[1], y)
@@ -1196,21 +1326,29 @@ class EndlessMultiPlayer(State):
         screen.blit(opponent_box, (0, y+self.camera.rect.y))
 
         if self.opponent_lost:
-            screen.blit(self.end_font.render('You win', 1, (0, 255,0)), (300, 300))
+            screen.blit(render_text(self.end_font, 'You win', (0, 255,0)), (300, 300))
             pygame.display.update()
-            pygame.time.wait(2000)
+            self.manager.pause(2000)
             self.lost = False
             self.to_send['lose'] = self.lost
+            self.worker.stop()
             self.server_reply = self.client.update(self.to_send)
-            self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+            self.leave()
         elif self.lost:
-            screen.blit(self.end_font.render('You lose', 1, (255, 0, 0)), (300, 300))
+            # The worker may not have sent the loss yet, so send it here before
+            # the pause gives the opponent time to see it.
+            self.worker.stop()
+            self.server_reply = self.client.update(self.to_send)
+            screen.blit(render_text(self.end_font, 'You lose', (255, 0, 0)), (300, 300))
             pygame.display.update()
-            pygame.time.wait(2000)
+            self.manager.pause(2000)
             self.lost = False
             self.to_send['lose'] = self.lost
             self.server_reply = self.client.update(self.to_send)
-            self.manager.switch(MultiPlayerMenu(images=self.IMAGES, client=self.client, server=self.server, id=self.id))
+            self.leave()
+
+    def moving(self):
+        return [self.player, self.camera]
 
     def update_objects(self, clock):
         self.player.update(clock, self.ground, self.gravity, self.deccel, self.blocks)
@@ -1218,15 +1356,17 @@ class EndlessMultiPlayer(State):
 
         self.blocks = self.level_constructor.update_block_chunks(self.camera)
         
-        if pygame.time.get_ticks() - self.time >= 10 * 1000:
-            self.time = pygame.time.get_ticks()
+        self.time += clock.get_time()
+        if self.time >= 10 * 1000: # Every so seconds
+            self.time = 0
             self.camera.increment += 1
         
         self.to_send['player-y'] = self.player.rect.y
         self.to_send['player-score'] = self.player.score
         self.to_send['lose'] = self.lost
         
-        self.server_reply = self.client.update(self.to_send)
+        self.worker.post(self.to_send)
+        self.server_reply = self.worker.latest()
         
         for key, value in self.server_reply['players-endless'].items():
             if key != self.id:
@@ -1237,8 +1377,12 @@ class EndlessMultiPlayer(State):
                     self.opponent_lost = value[3]
         
     def handle_events(self, events):
+        if not self.worker.connected:
+            self.leave()
+            return
+
         if self.player.events(events, self.blocks, self.camera):
             self.lost = True
             self.to_send['lose'] = self.lost
-            self.server_reply = self.client.update(self.to_send)
+            self.worker.post(self.to_send)
     
\ No newline at end of file
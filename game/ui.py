@@ -1,12 +1,11 @@
 import pygame
-from util.setup import generate_button_sound
+from util.assets import ASSETS
+from util.text_cache import get_font, render_text
 
 '''
 ui elements mostly independent from camera movement.
 '''
 
-SOUNDS = generate_button_sound()
-
 class TextBox:
     '''
     Represents a box where text may be written.
@@ -18,8 +17,8 @@ class TextBox:
         self.color = (255, 255, 255)
         self.alt_color = (129, 230, 179)
         self.active = False
-        self.font = pygame.font.SysFont('Courier', 18)
-        self.rendered_text = self.font.render(initial_text, True, (0, 0, 0))
+        self.font = get_font('Courier', 18)
+        self.rendered_text = render_text(self.font, initial_text, (0, 0, 0))
         self.ready = False
         self.text = initial_text
         self.enable_write = True
@@ -41,7 +40,7 @@ class TextBox:
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if self.rect.collidepoint(event.pos):
                         self.text = ''
-                        self.rendered_text = self.font.render('', True, (0, 0, 0))  
+                        self.rendered_text = render_text(self.font, '', (0, 0, 0))
                         self.active = not self.active
                     else:
                         self.active = False
@@ -67,7 +66,7 @@ class TextBox:
                         else:
                             self.text += event.unicode
 
-        self.rendered_text = self.font.render(self.text, True, (0, 0, 0))
+        self.rendered_text = render_text(self.font, self.text, (0, 0, 0))
         return ''
 
 class Button:
@@ -81,7 +80,7 @@ class Button:
         self.font_name = font
         self.font_size = size
         self.text_color = text_color
-        self.rendered = pygame.font.SysFont(self.font_name, self.font_size).render(self.text, True, self.text_color)
+        self.rendered = get_font(self.font_name, self.font_size).render(self.text, True, self.text_color)
         self.text_size = self.rendered.get_size()
         self.color = color
         self.alt_color = alt_color
@@ -93,7 +92,7 @@ class Button:
             pygame.draw.rect(screen, self.alt_color, (self.rect.x - 5, self.rect.y - 5, self.rect.width + 10, self.rect.height+10))
 
         if overwrite_text:
-            new_text = pygame.font.SysFont(self.font_name, self.font_size).render(overwrite_text, True, self.text_color)
+            new_text = render_text(get_font(self.font_name, self.font_size), overwrite_text, self.text_color)
             new_text_size = new_text.get_size()
             screen.blit(new_text, (self.rect.x + self.rect.width//2 - new_text_size[0]//2,
              self.rect.y + self.rect.height//2 - new_text_size[1]//2))
@@ -114,7 +113,7 @@ class Button:
         area = self.check_area()
         for event in events:
             if area and (event.type == pygame.MOUSEBUTTONDOWN):
-                SOUNDS['button_pass'].play()
+                ASSETS.get('button_pass').play()
                 return True
 
 class Tab:
@@ -134,7 +133,7 @@ class Tab:
         self.font_name = font
         self.font_size = size
         self.text_color = text_color
-        self.rendered = pygame.font.SysFont(self.font_name, self.font_size).render(self.text, True, self.text_color)
+        self.rendered = get_font(self.font_name, self.font_size).render(self.text, True, self.text_color)
         self.text_size = self.rendered.get_size()
         self.color = color
         self.alt_color = alt_color
@@ -176,7 +175,7 @@ class Tab:
     size=size, color=color, alt_color=alt_color, text_color=text_color)
 
     def construct_inner_text(self, text, font, size, color):
-        self.inner_text.append(pygame.font.SysFont(font, size).render(text, True, color))
+        self.inner_text.append(get_font(font, size).render(text, True, color))
     
     def construct_inner_image(self, image):
         self.image = image
@@ -0,0 +1,156 @@
+'''
+Runs game modes without a display or audio, as fast as the CPU allows.
+The player is driven by a script (see game/input.py) instead of the keyboard.
+
+usage: headless.py level [level id] [frames] [--draw]
+       headless.py endless [frames] [--draw]
+       headless.py race [frames]
+'''
+import os
+import sys
+import threading
+import time
+
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+import pygame
+
+pygame.init()
+pygame.mixer.quit() # no mixer: sounds load as silent NullSounds (see util.assets).
+
+from util.setup import get_config
+from util.assets import ASSETS
+
+screen = pygame.display.set_mode(get_config()['size'])
+
+from game.states import StateManager, FixedStep, LevelSingle, EndlessSingle, RaceMultiPlayer
+from game.input import ScriptedInput, digger
+from server.game_server import GServer, GClient
+from util.profiler import FrameProfiler
+
+
+def new_manager():
+    return StateManager(images=ASSETS.get('states'), volume=0, music=ASSETS.get('bgm'), headless=True)
+
+
+def result(mode, state, player, frames, start):
+    seconds = time.perf_counter() - start
+    return {
+        'mode' : mode,
+        'frames' : frames,
+        'game seconds' : round(frames * StateManager.STEP / 1000, 2),
+        'wall seconds' : round(seconds, 3),
+        'fps' : round(frames / seconds) if seconds else 0,
+        'score' : player.score,
+        'health' : player.health,
+        'position' : player.rect.topleft,
+        'ended on' : str(state.manager.state)
+    }
+
+
+def run_single(state, frames=3600, script=digger, draw=False, profiler=None):
+    '''
+    Plays a single player state for up to frames frames (one physics step each),
+    stopping early when the state ends (game over, win).
+    Each frame is timed with profiler (a FrameProfiler) when one is given.
+    '''
+    profiler = profiler or FrameProfiler(phases=('events', 'update', 'draw'), window=frames)
+    manager = new_manager()
+    manager.switch(state)
+    source = state.player.input = ScriptedInput(script)
+    clock = FixedStep(StateManager.STEP)
+
+    start = time.perf_counter()
+    frame = 0
+    while frame < frames and manager.state is state:
+        profiler.begin()
+        state.handle_events(source.next_frame())
+        profiler.lap('events')
+        manager.update(clock)
+        profiler.lap('update')
+        if draw:
+            manager.draw(screen)
+        profiler.lap('draw')
+        profiler.end()
+        frame += 1
+
+    return result(state.name, state, state.player, frame, start)
+
+
+def run_race(frames=3600, script=digger):
+    '''
+    Plays a race between two scripted players through a local server.
+    Both states are always drawn, since the race result is handled in draw_screen.
+    '''
+    server = GServer('127.0.0.1', 0)
+    port = server.s.getsockname()[1]
+    threading.Thread(target=server.handle_connections, daemon=True).start()
+
+    players = []
+    for i in range(2):
+        client = GClient('127.0.0.1', port)
+        pid = client.connect()
+        client.update({'type' : 'menu', 'name' : f'bot{i}', 'ready' : True, 'started' : True, 'mode' : True, 'changemode' : False})
+        players.append((client, pid))
+
+    # The server answers each race setup as soon as it arrives. Both players
+    # joined the room in the menu step above, so each answer lists them both.
+    # The states are made side by side, like two game windows joining at once.
+    states = [None, None]
+    def join(i):
+        client, pid = players[i]
+        states[i] = RaceMultiPlayer(images=ASSETS.get('states'), client=client, id=pid)
+    threads = [threading.Thread(target=join, args=(i,)) for i in range(2)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    managers, sources, controlled = [], [], []
+    for state in states:
+        manager = new_manager()
+        manager.switch(state)
+        managers.append(manager)
+        controlled.append(state.player if state.id == state.server_reply['p1'] else state.player2)
+        sources.append(ScriptedInput(script))
+        controlled[-1].input = sources[-1]
+    clock = FixedStep(StateManager.STEP)
+
+    start = time.perf_counter()
+    frame = 0
+    while frame < frames and all(m.state is s for m, s in zip(managers, states)):
+        for manager, state, source in zip(managers, states, sources):
+            state.handle_events(source.next_frame())
+            manager.update(clock)
+            manager.draw(screen)
+        frame += 1
+
+    outcome = result(states[0].name, states[0], controlled[0], frame, start)
+    for state in states:
+        if state.manager.state is state:
+            state.leave()
+    server.shutdown()
+    return outcome
+
+
+def main(args):
+    draw = '--draw' in args
+    args = [a for a in args if a != '--draw']
+    mode = args[0] if args else 'level'
+
+    if mode == 'level':
+        level = args[1] if len(args) > 1 else '9'
+        frames = int(args[2]) if len(args) > 2 else 3600
+        print(run_single(LevelSingle(images=ASSETS.get('states'), level=level), frames, draw=draw))
+    elif mode == 'endless':
+        frames = int(args[1]) if len(args) > 1 else 3600
+        print(run_single(EndlessSingle(images=ASSETS.get('states')), frames, draw=draw))
+    elif mode == 'race':
+        frames = int(args[1]) if len(args) > 1 else 3600
+        print(run_race(frames))
+    else:
+        print(__doc__)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
+    pygame.quit()
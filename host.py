@@ -1,10 +1,14 @@
 from server.game_server import GServer
 import sys
 
-if len(sys.argv) == 2:
-    server = GServer('', int(sys.argv[1]))
+# usage: host.py [port] [tick rate]
+# Without a tick rate the server answers each message as it comes in.
+tick_rate = int(sys.argv[2]) if len(sys.argv) == 3 else None
+
+if len(sys.argv) >= 2:
+    server = GServer('', int(sys.argv[1]), tick_rate=tick_rate)
 else:
     port = input('port:')
     server = GServer(ip='', port=int(port))
 
-server.handle_connections()
\ No newline at end of file
+server.handle_connections()
@@ -9,11 +9,22 @@ pygame.mixer.init()
 from game.states import *
 from util.fps import *
 from util.setup import *
+from util.assets import ASSETS
+from util.profiler import FrameProfiler
 
 
+def frame_info(state, clock):
+    info = {'fps' : int(clock.get_fps())}
+    if hasattr(state, 'blocks'):
+        info['blocks'] = len(state.blocks)
+    if hasattr(state, 'blocks') and state.blocks.released:
+        info['block slots'] = f'{state.blocks.created} ({state.blocks.reused} reused)'
+    if hasattr(state, 'worker'):
+        info['rtt ms'] = round(state.worker.rtt * 1000, 1)
+    return info
+
 def main():
     config = get_config()
-    fps = config['fps']
     volume = config['volume']
     WIDTH, HEIGHT = config['size'][0], config['size'][1]
     
@@ -26,37 +37,45 @@ def main():
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     print(f'[Game] Running screen at {WIDTH} x {HEIGHT}')
 
-    bgm = pygame.mixer.Sound(get_path('res/sounds/bgm.wav'))
+    bgm = ASSETS.get('bgm')
     bgm.set_volume(volume)
     bgm.play(-1)
+    config.subscribe('volume', bgm.set_volume)
 
-    state_manage = StateManager(images=generate_state_images(), volume=volume, music=bgm)
+    state_manage = StateManager(images=ASSETS.get('states'), volume=volume, music=bgm)
+    ASSETS.warm() # the rest loads in the background while the menu is up.
     
+    profiler = FrameProfiler() # F3: show frame timings, F4: save them to a file.
     running = True
 
     while running:
-        bgm.set_volume(volume)
-
+        fps = config['fps']
         if fps != -1:
             clock.tick_busy_loop(fps)
         else:
             clock.tick_busy_loop()
+        profiler.begin()
         
         events = pygame.event.get()
         for event in events:
             if event.type == pygame.QUIT:
                 running = False
+        profiler.events(events)
 
         state_manage.state.handle_events(events)
-        state_manage.state.update_objects(clock)
-        state_manage.state.draw_screen(screen)
-        draw_fps(screen, clock)
+        profiler.lap('events')
+        state_manage.update(clock)
+        profiler.lap('update')
+        state_manage.draw(screen)
+        if profiler.visible:
+            profiler.draw(screen)
+        else:
+            draw_fps(screen, clock)
+        profiler.lap('draw')
 
         pygame.display.update()
-
-        fps = update_fps(state_manage.state, fps)
-
-        volume = state_manage.volume
+        profiler.lap('display')
+        profiler.end(**frame_info(state_manage.state, clock))
         
 
 
@@ -1,10 +1,62 @@
+import asyncio
+import os
 import socket
 import pygame
 import sys
 import pickle
+import struct
 import threading
 import time
 from multiprocessing.connection import Listener, Client
+from server.rooms import Room, RoomRegistry, DEFAULT_ROOM
+from server import protocol
+
+MAX_PENDING_PUSH = 1024 * 64 # bytes
+
+
+async def read_message(reader):
+    '''
+    Reads one framed message from an asyncio stream.
+    Uses the same framing as multiprocessing.connection so that
+    the sync GClient can talk to the asyncio server.
+    '''
+    size, = struct.unpack('!i', await reader.readexactly(4))
+    if size == -1:
+        size, = struct.unpack('!Q', await reader.readexactly(8))
+
+    return await reader.readexactly(size)
+
+def write_frame(writer, buf):
+    '''
+    Queues one framed message on an asyncio stream.
+    '''
+    n = len(buf)
+    if n > 0x7fffffff:
+        header = struct.pack('!i', -1) + struct.pack('!Q', n)
+    else:
+        header = struct.pack('!i', n)
+
+    writer.write(header + buf)
+
+async def write_message(writer, buf):
+    '''
+    Writes one framed message to an asyncio stream.
+    '''
+    write_frame(writer, buf)
+    await writer.drain()
+
+def read_reply(decoder, payload):
+    '''
+    Decodes a reply from the server, binary or pickled.
+    Returns (reply, whether it answers the client's last message).
+    '''
+    if protocol.is_binary(payload):
+        reply = decoder.decode(payload)
+        return reply, decoder.answered
+
+    reply = pickle.loads(payload)
+    return reply, not isinstance(reply, dict) or reply.get('reply', True)
+
 
 class GClient:
     '''
@@ -15,6 +67,8 @@ class GClient:
         self.port = port
         self.address = (self.ip, self.port)
         self.s = None
+        self.protocol = 0 # 0 is pickle, otherwise the binary protocol version.
+        self.decoder = protocol.ReplyDecoder()
          
     def connect(self):
         '''
@@ -23,10 +77,23 @@ class GClient:
         try:
             self.s = Client(self.address)
 
-            return self.s.recv()
+            pid = self.s.recv()
+            self.negotiate()
+            return pid
 
         except Exception as e:
             self.s.close()
+
+    def negotiate(self):
+        '''
+        Asks the server for the binary protocol. Old servers answer the
+        handshake with their usual server_data dict, which has no type 'hello',
+        so we stay on pickle.
+        '''
+        reply = self.update(protocol.negotiate_request())
+        if isinstance(reply, dict) and reply.get('type') == 'hello':
+            self.protocol = reply['protocol']
+        print(f'[Game] Using {"binary protocol v" + str(self.protocol) if self.protocol else "pickle"}')
     
     def send(self, to_send):
         '''
@@ -51,50 +118,263 @@ class GClient:
         '''
         Sends the object in the argument, and returns the reply from the server.
         '''
-        self.send(to_send)
-        return self.receive()
+        try:
+            if self.protocol and protocol.message_type(to_send) is not None:
+                self.s.send_bytes(protocol.encode_request(to_send, self.decoder.ack))
+            else:
+                self.s.send(to_send)
+
+            # A server in tick mode also pushes snapshots we didn't ask for;
+            # apply them on the way to the one that answers this message.
+            while True:
+                reply, answered = read_reply(self.decoder, self.s.recv_bytes())
+                if answered:
+                    return reply
+
+        except Exception as e:
+            print(f'[Game] Lost the connection to the server: {e!r}')
+            self.s.close()
     
+    def list_rooms(self):
+        '''
+        Returns the lobby reply listing the rooms on the server.
+        '''
+        return self.update({'type' : 'lobby', 'action' : 'list'})
+
+    def create_room(self, room, mode=True):
+        '''
+        Creates a room and joins it. Check 'error' in the reply.
+        '''
+        return self.update({'type' : 'lobby', 'action' : 'create', 'room' : room, 'mode' : mode})
+
+    def join_room(self, room=DEFAULT_ROOM):
+        '''
+        Joins an existing room. Check 'error' in the reply.
+        '''
+        return self.update({'type' : 'lobby', 'action' : 'join', 'room' : room})
+
     def close(self):
         self.s.close()
 
 
+
+
+class NetworkWorker:
+    '''
+    Runs GClient.update on a background thread so that the game never waits on the network.
+    post() hands over the latest message, latest() returns the latest reply.
+    Both are a single reference swap, so neither side blocks the other;
+    messages posted while a request is in flight are replaced, not queued.
+    Stop the worker before using the client directly again.
+    '''
+    def __init__(self, client, to_send, reply=None):
+        self.client = client
+        self.outbox = dict(to_send)
+        self.reply = reply
+        self.rtt = 0 # seconds, last round trip
+        self.connected = True
+        self.running = True
+        self.posted = threading.Event()
+        self.posted.set()
+
+        self.thread = threading.Thread(target=self.run, daemon=True, name='network-worker')
+        self.thread.start()
+
+    def post(self, to_send):
+        '''
+        Replaces the message to send next. The dict is copied, so the caller may keep changing it.
+        '''
+        self.outbox = dict(to_send)
+        self.posted.set()
+
+    def latest(self):
+        return self.reply
+
+    def run(self):
+        while self.running:
+            self.posted.wait()
+            self.posted.clear()
+            if not self.running:
+                break
+
+            start = time.perf_counter()
+            reply = self.client.update(self.outbox)
+            self.rtt = time.perf_counter() - start
+
+            if reply is None:
+                print('[Game] Network worker lost the connection')
+                self.connected = False
+                self.running = False
+                break
+
+            self.reply = reply
+
+    def stop(self):
+        '''
+        Stops the worker, waiting for the request in flight to finish.
+        '''
+        self.running = False
+        self.posted.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+class AsyncGClient:
+    '''
+    Represents a game client that connects to the server from an asyncio event loop.
+    Speaks the same protocol as GClient.
+    '''
+    def __init__(self, ip='', port=6969):
+        self.ip = ip
+        self.port = port
+        self.address = (self.ip, self.port)
+        self.reader = None
+        self.writer = None
+        self.protocol = 0
+        self.decoder = protocol.ReplyDecoder()
+
+    async def connect(self):
+        '''
+        Connects to the server and returns the id for the client.
+        '''
+        self.reader, self.writer = await asyncio.open_connection(self.ip or '127.0.0.1', self.port)
+
+        pid = await self.receive()
+        reply = await self.update(protocol.negotiate_request())
+        if isinstance(reply, dict) and reply.get('type') == 'hello':
+            self.protocol = reply['protocol']
+        return pid
+
+    async def send(self, to_send):
+        '''
+        Sends the object seralized by pickle.
+        '''
+        await write_message(self.writer, pickle.dumps(to_send))
+
+    async def receive(self):
+        '''
+        Receives data sent by the server and returns it.
+        '''
+        return pickle.loads(await read_message(self.reader))
+
+    async def update(self, to_send):
+        '''
+        Sends the object in the argument, and returns the reply from the server.
+        '''
+        if self.protocol and protocol.message_type(to_send) is not None:
+            await write_message(self.writer, protocol.encode_request(to_send, self.decoder.ack))
+        else:
+            await self.send(to_send)
+
+        while True:
+            reply, answered = read_reply(self.decoder, await read_message(self.reader))
+            if answered:
+                return reply
+
+    async def list_rooms(self):
+        return await self.update({'type' : 'lobby', 'action' : 'list'})
+
+    async def create_room(self, room, mode=True):
+        return await self.update({'type' : 'lobby', 'action' : 'create', 'room' : room, 'mode' : mode})
+
+    async def join_room(self, room=DEFAULT_ROOM):
+        return await self.update({'type' : 'lobby', 'action' : 'join', 'room' : room})
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class Connection:
+    '''
+    Represents one client connected to the GServer.
+    '''
+    def __init__(self, pid, writer, answer_every=False):
+        self.pid = pid
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.encoder = protocol.ReplyEncoder()
+        self.answer_every = answer_every # tick mode: mark which push answers the client.
+        self.last = None # (binary message type or None for pickle, ack, message) of the last game message.
+        self.waiting = False
+        # Clients that sent the hello handshake skip snapshots they didn't ask for.
+        # Older pickle clients read one reply per message, so they only get answers.
+        self.negotiated = False
+
+    def encode(self, room):
+        '''
+        Encodes the room state for this client, in the encoding of its last message.
+        '''
+        kind, ack, received = self.last
+        state = room.reply(self.pid, received)
+        answered = self.waiting or not self.answer_every
+        self.waiting = False
+
+        if kind is None:
+            return pickle.dumps(dict(state, reply=answered) if self.answer_every else state)
+        return self.encoder.encode(kind, state, ack, answered)
+
+    async def send(self, room):
+        await write_message(self.writer, self.encode(room))
+
+    def push(self, room):
+        '''
+        Tick mode: queues a snapshot without waiting for it to be written.
+        '''
+        write_frame(self.writer, self.encode(room))
+
+
 class GServer:
     '''
     Represents a game server that hosts multiplayer games.
+    Every match is played in its own room (see server/rooms.py).
+    All connections are multiplexed on a single asyncio event loop;
+    handle_connections() and shutdown() are the blocking/sync entry points.
     '''
-    def __init__(self, ip='', port=6969):
+    def __init__(self, ip='', port=6969, tick_rate=None):
         # The ip should be left empty to accept all incoming connections.
         self.ip = ip
         self.port = port
         self.address = (self.ip, self.port)
-        self.s = Listener(self.address)
-    
+
+        # None: answer each message as it comes in.
+        # Otherwise: queue messages and push snapshots to every client tick_rate times per second.
+        self.tick_rate = tick_rate
+
+        # Bind right away so that a bad address fails here, like the old Listener did.
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if os.name == 'posix':
+            self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self.s.bind(self.address)
+            self.s.listen()
+        except OSError:
+            self.s.close()
+            raise
+
         self.running = True
         self.id_count = int(round(time.time()))
 
         self.BUFFER_SIZE = 1024 * 14
 
-        self.player_names = {}
-        self.server_data = {
-            'full' : False,
-            'mode' : True,
-            'players' : {},
-            'players-endless': {},
-            'players-race': {},
-            'blocks' : set(),
-            'ready' : {},
-            'start' : False,
-            'started' : {},
-            'p1' : 0,
-            'p2' : 0,
-            'quit' : {},
-            'win' : {}
-        }
+        self.loop = None
+        self.stop_event = None
+        self.connections = {}
+
+        self.rooms = RoomRegistry()
         
         print('[Server] Started')
     
     def shutdown(self):
-        self.s.close()
+        '''
+        Stops the server. Safe to call from any thread.
+        '''
+        self.running = False
+
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        else:
+            self.s.close()
 
         print('[Server] Closing main socket and shutting down')
 
@@ -104,139 +384,190 @@ class GServer:
         Will run in a loop until interrupted
         '''
         print('[Server] Looking for connections..')
-        
+
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.s.close()
+
+    async def serve(self):
+        '''
+        Runs the server on the current event loop until shutdown() is called.
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+
+        if not self.running:
+            return
+
+        server = await asyncio.start_server(self.game_connection, sock=self.s)
+        ticker = self.loop.create_task(self.tick_loop()) if self.tick_rate else None
+
+        async with server:
+            await self.stop_event.wait()
+
+            if ticker:
+                ticker.cancel()
+
+            # Closing the streams wakes up every connection so they can clean up.
+            connections = list(self.connections.values())
+            for connection in connections:
+                connection.writer.close()
+            await asyncio.gather(*[connection.task for connection in connections], return_exceptions=True)
+
+    async def tick_loop(self):
+        '''
+        Tick mode: applies the queued messages of every room and pushes
+        one snapshot to each room member, tick_rate times per second.
+        '''
+        print(f'[Server] Running at {self.tick_rate} ticks per second')
+        interval = 1 / self.tick_rate
+        next_tick = self.loop.time()
+
         while self.running:
-            try:
-                connection = self.s.accept()
+            for room in list(self.rooms.rooms.values()):
+                try:
+                    self.tick_room(room)
+                except Exception as e:
+                    # Never let one room stop the ticks of every other room.
+                    print(f'[Server] Tick failed for room {room.name}: {e!r}')
+
+            next_tick += interval
+            await asyncio.sleep(max(0, next_tick - self.loop.time()))
 
-                if not self.running:
-                    self.s.close()
-                    break
+    def tick_room(self, room):
+        '''
+        Applies the queued messages of the room and pushes a snapshot to its members.
+        A player whose message fails is disconnected, like outside of tick mode.
+        '''
+        failed = room.apply_inputs()
 
-                print(f'[Server] Starting new thread for {self.id_count} on {connection}')
-                job = threading.Thread(target=self.game_connection, args=(connection, self.id_count), daemon=True, name=str(self.id_count))
-                job.start()
+        for pid in list(room.members):
+            connection = self.connections.get(pid)
+            # Skip clients that aren't reading; they'd only pile up stale snapshots.
+            if (pid not in failed and connection and connection.last and not connection.writer.is_closing()
+             and (connection.negotiated or connection.waiting)
+             and connection.writer.transport.get_write_buffer_size() < MAX_PENDING_PUSH):
+                try:
+                    connection.push(room)
+                except Exception as e:
+                    print(f'[Server] Could not send to {pid}: {e!r}')
+                    failed.append(pid)
 
-                self.id_count += 1
-            except Exception as e:
-                pass
-            
+        for pid in failed:
+            connection = self.connections.get(pid)
+            if connection:
+                connection.writer.close() # game_connection cleans up after it.
 
-    def game_connection(self, s, pid):
+    async def game_connection(self, reader, writer):
         '''
-        A game connection to the server, represented by the socket.
+        A game connection to the server, represented by the stream pair.
         Should be kept alive as long as the game is connected to the server.
         '''
+        pid = self.id_count
+        self.id_count += 1
+        connection = Connection(pid, writer, answer_every=self.tick_rate is not None)
+        self.connections[pid] = connection
+
+        print(f'[Server] New connection for {pid} on {writer.get_extra_info("peername")}')
+
         ############################
         # assign pid when client connects.
-        s.send(pid) 
-        
-        ############################
-        # handle updates from client.
-        # client sends different dicts depending on the state. check type first.
-        while self.running:
-            try:
-                received = s.recv()
-            
-                if not received:
-                    self.server_data['players'].pop(pid)
-                    self.server_data['players-endless'].pop(pid)
-                    self.server_data['players-race'].pop(pid)
-                    self.server_data['ready'].pop(pid)
-                    self.server_data['started'].pop(pid)
-                    self.server_data['quit'].pop(pid)
-                    self.server_data['win'].pop(pid)
-                    print('Did not receive data from client')
-                    break
-
-                # Menu updates.
-                elif received['type'] == 'menu':
-                    #print(f'[Server] Received {received}')
-                    if len(self.server_data['players']) == 2:
-                        self.server_data['full'] = True
-                    else:
-                        self.server_data['players'][pid] = received['name']
-                        self.server_data['full'] = False  
-                        self.player_names[pid] = received['name']
-
-                    self.server_data['ready'][pid] = received['ready']
-
-                    self.server_data['start'] = sum([status for status in self.server_data['ready'].values()]) == 2
-                    
-                    self.server_data['started'][pid] = received['started']
-
-                    if received['changemode']:
-                        self.server_data['mode'] = received['mode']
-
-
-                # Ingame updates
-                # note there are only two players in the game.
-                elif received['type'] == 'ingame-race':
-                    if received['setup']:
-                        print('[Server] Setting up for', pid)
-                        self.server_data['quit'][pid] = False
-                        self.server_data['win'][pid] = False
-                        alternate = True
-                        for key, value in self.server_data['players'].items():
-                            if alternate:
-                                self.server_data['players-race'][key] = {
-                                    'x' : 64,
-                                    'y' : 50,
-                                    'width' : 32,
-                                    'height' : 32,
-                                    'speed' : 0,
-                                    'accel' : 3,
-                                    'jump_accel' : 15,
-                                    'name' : self.player_names[key]
-                                }
-                                self.server_data['p1'] = key
-                                alternate = not alternate
-                            else:
-                                self.server_data['players-race'][key] = {
-                                    'x' : 1100,
-                                    'y' : 50,
-                                    'width' : 32,
-                                    'height' : 32,
-                                    'speed' : 0,
-                                    'accel' : 3,
-                                    'jump_accel' : 15,
-                                    'name' : self.player_names[key]
-                                }
-                                self.server_data['p2'] = key
-                    
-                    elif received['init-blocks']:
-                        self.server_data['blocks'].update(received['blocks'])
-                        #print('[Server] blocks', self.server_data['blocks'])
-                        
-                    else:
-                        self.server_data['players-race'][pid]['x'] = received['player']['x']
-                        self.server_data['players-race'][pid]['y'] = received['player']['y']
-
-                        self.server_data['blocks'].intersection_update(received['blocks'])
-
-                        self.server_data['quit'][pid] = received['quit']
-                        self.server_data['win'][pid] = received['win']
-                
-                elif received['type'] == 'ingame-endless':
-                    self.server_data['players-endless'][pid] = [received['player-y'], received['player-score'], self.player_names[pid], received['lose']]
-
-                
-                
-                # Send server data at the end regardless of type of update.
-                s.send(self.server_data)
-            
-            except Exception as e:
-                self.server_data['players'].pop(pid)
-                self.server_data['players-endless'].pop(pid)
-                self.server_data['players-race'].pop(pid)
-                self.server_data['ready'].pop(pid)
-                self.server_data['started'].pop(pid)
-                self.server_data['quit'].pop(pid)
-                self.server_data['win'].pop(pid)
-                print('Interrupted, breaking', pid)
-                print(e)
-                break
-        
-        print(f'[Server] (Thread for {pid}) Closing connection')
-        s.close()
+        try:
+            await write_message(writer, pickle.dumps(pid))
 
+            ############################
+            # handle updates from client.
+            # every reply uses the same encoding as the message it answers.
+            while self.running:
+                payload = await read_message(reader)
+
+                if protocol.is_binary(payload):
+                    connection.negotiated = True
+                    kind, ack, received = protocol.decode_request(payload)
+                else:
+                    kind, ack, received = None, 0, pickle.loads(payload)
+
+                    if not received:
+                        print('Did not receive data from client')
+                        break
+
+                    # Handshake and lobby messages are always answered right away.
+                    if received['type'] == 'hello':
+                        connection.negotiated = True
+                        await write_message(writer, pickle.dumps(protocol.negotiate_reply(received)))
+                        continue
+                    elif received['type'] == 'lobby':
+                        await write_message(writer, pickle.dumps(self.process_lobby_message(pid, received)))
+                        continue
+
+                room = self.rooms.room_of(pid)
+                if room is None:
+                    # Clients that never pick a room all share the default one.
+                    room = self.rooms.join_default(pid)
+                    if room is None:
+                        full = Room(DEFAULT_ROOM)
+                        full.state['full'] = True
+                        connection.last = (kind, ack, received)
+                        connection.waiting = True # this is the answer, even in tick mode.
+                        await connection.send(full)
+                        continue
+
+                connection.last = (kind, ack, received)
+                if self.tick_rate:
+                    room.queue(pid, received)
+                    connection.waiting = True
+                else:
+                    room.apply(pid, received)
+                    await connection.send(room)
+
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            print('Interrupted, breaking', pid)
+
+        except Exception as e:
+            print('Interrupted, breaking', pid)
+            print(e)
+
+        finally:
+            self.rooms.leave(pid)
+            self.connections.pop(pid, None)
+            writer.close()
+
+            print(f'[Server] (Connection for {pid}) Closing connection')
+
+    def process_lobby_message(self, pid, received):
+        '''
+        Handles the create/join/list/leave lobby actions.
+        '''
+        action = received['action']
+        error = None
+
+        if action == 'create':
+            room = self.rooms.create(received['room'], received.get('mode', True))
+            if room is None:
+                error = 'Room already exists'
+            else:
+                self.rooms.join(pid, room.name)
+
+        elif action == 'join':
+            if self.rooms.get(received['room']) is None:
+                error = 'No such room'
+            elif self.rooms.join(pid, received['room']) is None:
+                error = 'Room is full'
+
+        elif action == 'leave':
+            self.rooms.leave(pid)
+
+        elif action != 'list':
+            error = f'Unknown action {action}'
+
+        room = self.rooms.room_of(pid)
+
+        return {
+            'type' : 'lobby',
+            'room' : room.name if room else None,
+            'rooms' : self.rooms.listing(),
+            'error' : error
+        }
@@ -0,0 +1,483 @@
+'''
+Compact binary wire protocol for GClient/GServer.
+
+Every binary message starts with HEADER: a magic byte, the protocol version,
+the message type, a flags byte and a sequence number. The body layout depends
+on the message type and on the direction (client request or server reply).
+In requests the sequence number acknowledges the last reply the client applied,
+in replies it numbers the snapshot.
+
+Pickled dicts are still understood by the server. A client only switches to
+the binary format after the pickled 'hello' handshake (see negotiate_request()),
+so old clients and old servers keep talking pickle to each other.
+Old servers do answer the handshake, like any other message, with their
+server_data dict. That reply has no type 'hello', which is what keeps the
+client on pickle; keep it that way.
+'''
+import struct
+import sys
+from array import array
+from itertools import chain
+
+MAGIC = 0xB7
+PROTOCOL_VERSION = 3 # 2: delta-compressed replies, 3: block break log
+SUPPORTED_VERSIONS = (PROTOCOL_VERSION,)
+
+KEYFRAME_INTERVAL = 60
+MAX_HISTORY = 32
+
+# Message types
+MSG_MENU = 1
+MSG_RACE_SETUP = 2
+MSG_RACE_TICK = 3
+MSG_ENDLESS_TICK = 4
+
+# Header flags
+F_READY = 1
+F_STARTED = 2
+F_CHANGEMODE = 4
+F_MODE = 8
+F_FULL = 16
+F_START = 32
+F_REPLY = 64 # the snapshot answers the client's last message (always set outside tick mode)
+F_KEYFRAME = 128
+
+F_SETUP = 1
+
+F_QUIT = 1
+F_WIN = 2
+
+F_LOSE = 1
+
+# Reply field mask
+S_PIDS = 1
+S_PLAYERS = 2
+S_BREAKS = 4
+
+# Per-player record flags
+R_READY = 1
+R_STARTED = 2
+R_NAMED = 4
+
+HEADER = struct.Struct('!BBBBI')
+BASE = struct.Struct('!IB')
+U8 = struct.Struct('!B')
+U32 = struct.Struct('!I')
+PIDS = struct.Struct('!qq')
+U16 = struct.Struct('!H')
+POSITION = struct.Struct('!ii')
+MENU_RECORD = struct.Struct('!qB')
+RACE_SETUP_RECORD = struct.Struct('!qiiiiiii')
+RACE_TICK_RECORD = struct.Struct('!qiiB')
+ENDLESS_RECORD = struct.Struct('!qiiB')
+
+SWAP_IDS = sys.byteorder == 'little'
+NO_BREAKS = (0, ())
+
+
+def is_binary(payload):
+    '''
+    Pickled payloads never start with the magic byte.
+    '''
+    return len(payload) >= HEADER.size and payload[0] == MAGIC
+
+def negotiate_request():
+    '''
+    The pickled message a client sends to ask for the binary protocol.
+    '''
+    return {'type' : 'hello', 'protocols' : list(SUPPORTED_VERSIONS)}
+
+def negotiate_reply(received):
+    '''
+    The pickled reply to a 'hello'. A protocol of 0 means: stay on pickle.
+    '''
+    common = set(received.get('protocols', [])).intersection(SUPPORTED_VERSIONS)
+    return {'type' : 'hello', 'protocol' : max(common) if common else 0}
+
+def message_type(to_send):
+    '''
+    Returns the binary message type for a client dict, or None if it has to be pickled.
+    '''
+    kind = to_send.get('type')
+    if kind == 'menu':
+        return MSG_MENU
+    elif kind == 'ingame-race':
+        return MSG_RACE_SETUP if to_send['setup'] else MSG_RACE_TICK
+    elif kind == 'ingame-endless':
+        return MSG_ENDLESS_TICK
+    return None
+
+##########################################################################
+# Strings and block ids
+
+def pack_name(name):
+    raw = name.encode('utf-8')[:255]
+    return U8.pack(len(raw)) + raw
+
+def unpack_name(buf, offset):
+    n = buf[offset]
+    offset += 1
+    return str(buf[offset:offset + n], 'utf-8', 'replace'), offset + n
+
+def pack_ids(ids):
+    '''
+    Packs block ids as a count and uint16s.
+    '''
+    ids = array('H', ids)
+    if SWAP_IDS:
+        ids.byteswap()
+    return U16.pack(len(ids)) + ids.tobytes()
+
+def unpack_ids(buf, offset):
+    n, = U16.unpack_from(buf, offset)
+    offset += U16.size
+    ids = array('H')
+    ids.frombytes(buf[offset:offset + n * 2])
+    if SWAP_IDS:
+        ids.byteswap()
+    return tuple(ids), offset + n * 2
+
+##########################################################################
+# Client -> server
+
+def encode_request(to_send, ack=0):
+    '''
+    Encodes a client dict. message_type(to_send) must not be None.
+    '''
+    kind = message_type(to_send)
+
+    if kind == MSG_MENU:
+        flags = ((F_READY if to_send['ready'] else 0) | (F_STARTED if to_send['started'] else 0)
+         | (F_CHANGEMODE if to_send['changemode'] else 0) | (F_MODE if to_send['mode'] else 0))
+        body = pack_name(to_send['name'])
+
+    elif kind == MSG_RACE_SETUP:
+        flags = F_SETUP
+        body = b''
+
+    elif kind == MSG_RACE_TICK:
+        flags = (F_QUIT if to_send['quit'] else 0) | (F_WIN if to_send['win'] else 0)
+        body = (POSITION.pack(to_send['player']['x'], to_send['player']['y'])
+         + U32.pack(to_send['break-ack']) + pack_ids(to_send['breaks']))
+
+    else:
+        flags = F_LOSE if to_send['lose'] else 0
+        body = POSITION.pack(to_send['player-y'], to_send['player-score'])
+
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, kind, flags, ack) + body
+
+def decode_request(payload):
+    '''
+    Decodes a binary client message into the dict the rooms understand.
+    Returns (message type, ack, dict).
+    '''
+    buf = memoryview(payload)
+    magic, version, kind, flags, ack = HEADER.unpack_from(buf, 0)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f'Unsupported protocol version {version}')
+    offset = HEADER.size
+
+    if kind == MSG_MENU:
+        name, offset = unpack_name(buf, offset)
+        received = {
+            'type' : 'menu',
+            'name' : name,
+            'ready' : bool(flags & F_READY),
+            'started' : bool(flags & F_STARTED),
+            'mode' : bool(flags & F_MODE),
+            'changemode' : bool(flags & F_CHANGEMODE)
+        }
+
+    elif kind == MSG_RACE_SETUP:
+        received = {
+            'type' : 'ingame-race',
+            'setup' : True
+        }
+
+    elif kind == MSG_RACE_TICK:
+        x, y = POSITION.unpack_from(buf, offset)
+        break_ack, = U32.unpack_from(buf, offset + POSITION.size)
+        breaks, offset = unpack_ids(buf, offset + POSITION.size + U32.size)
+        received = {
+            'type' : 'ingame-race',
+            'setup' : False,
+            'player' : {'x' : x, 'y' : y},
+            'breaks' : breaks,
+            'break-ack' : break_ack,
+            'quit' : bool(flags & F_QUIT),
+            'win' : bool(flags & F_WIN)
+        }
+
+    elif kind == MSG_ENDLESS_TICK:
+        y, score = POSITION.unpack_from(buf, offset)
+        received = {
+            'type' : 'ingame-endless',
+            'player-y' : y,
+            'player-score' : score,
+            'lose' : bool(flags & F_LOSE)
+        }
+
+    else:
+        raise ValueError(f'Unknown message type {kind}')
+
+    return kind, ack, received
+
+##########################################################################
+# Server -> client
+#
+# A reply is a snapshot of the fields its message type needs. The server
+# diffs every snapshot against the one the client last acknowledged (the seq
+# in the client's header) and only sends the fields that changed. Keyframes
+# carry every field and are sent when there is no usable base, for setup
+# messages, and every KEYFRAME_INTERVAL snapshots to resync.
+
+def build_view(kind, state):
+    '''
+    Returns (header flags, fields) for a reply of this type.
+    Field values are immutable so that they can be kept as a base for later diffs.
+    '''
+    fields = {}
+
+    if kind == MSG_MENU:
+        flags = ((F_FULL if state['full'] else 0) | (F_MODE if state['mode'] else 0)
+         | (F_START if state['start'] else 0))
+        players, ready, started = state['players'], state['ready'], state['started']
+        fields[S_PLAYERS] = tuple(
+            (pid, (R_READY if ready.get(pid) else 0) | (R_STARTED if started.get(pid) else 0)
+             | (R_NAMED if pid in players else 0), players.get(pid, ''))
+            for pid in dict.fromkeys(chain(players, ready, started))
+        )
+
+    elif kind == MSG_RACE_SETUP:
+        flags = 0
+        fields[S_PIDS] = (state['p1'], state['p2'])
+        fields[S_PLAYERS] = tuple(
+            (pid, p['x'], p['y'], p['width'], p['height'], p['speed'], p['accel'], p['jump_accel'], p['name'])
+            for pid, p in state['players-race'].items()
+        )
+
+    elif kind == MSG_RACE_TICK:
+        flags = 0
+        win, quit = state['win'], state['quit']
+        fields[S_PIDS] = (state['p1'], state['p2'])
+        fields[S_PLAYERS] = tuple(
+            (pid, p['x'], p['y'], (F_QUIT if quit.get(pid) else 0) | (F_WIN if win.get(pid) else 0))
+            for pid, p in state['players-race'].items()
+        )
+        # Not part of the snapshot: the break log entries this client hasn't seen.
+        fields[S_BREAKS] = state['breaks']
+
+    elif kind == MSG_ENDLESS_TICK:
+        flags = 0
+        fields[S_PLAYERS] = tuple(
+            (pid, y, score, 1 if lose else 0, name)
+            for pid, (y, score, name, lose) in state['players-endless'].items()
+        )
+
+    else:
+        raise ValueError(f'Unknown message type {kind}')
+
+    return flags, fields
+
+def pack_players(kind, players):
+    parts = [U8.pack(len(players))]
+
+    if kind == MSG_MENU:
+        for pid, record_flags, name in players:
+            parts.append(MENU_RECORD.pack(pid, record_flags))
+            parts.append(pack_name(name))
+    elif kind == MSG_RACE_SETUP:
+        for record in players:
+            parts.append(RACE_SETUP_RECORD.pack(*record[:-1]))
+            parts.append(pack_name(record[-1]))
+    elif kind == MSG_RACE_TICK:
+        for record in players:
+            parts.append(RACE_TICK_RECORD.pack(*record))
+    else:
+        for record in players:
+            parts.append(ENDLESS_RECORD.pack(*record[:-1]))
+            parts.append(pack_name(record[-1]))
+
+    return b''.join(parts)
+
+def unpack_players(kind, buf, offset):
+    players = []
+    n = buf[offset]
+    offset += 1
+
+    if kind == MSG_RACE_TICK:
+        for _ in range(n):
+            players.append(RACE_TICK_RECORD.unpack_from(buf, offset))
+            offset += RACE_TICK_RECORD.size
+    else:
+        record = {MSG_MENU : MENU_RECORD, MSG_RACE_SETUP : RACE_SETUP_RECORD, MSG_ENDLESS_TICK : ENDLESS_RECORD}[kind]
+        for _ in range(n):
+            values = record.unpack_from(buf, offset)
+            name, offset = unpack_name(buf, offset + record.size)
+            players.append(values + (name,))
+
+    return tuple(players), offset
+
+def encode_view(kind, flags, seq, base_seq, fields, base_fields=None):
+    '''
+    Encodes the fields that differ from base_fields (all of them for a keyframe).
+    '''
+    mask = 0
+    parts = []
+
+    if S_PIDS in fields and (base_fields is None or fields[S_PIDS] != base_fields[S_PIDS]):
+        mask |= S_PIDS
+        parts.append(PIDS.pack(*fields[S_PIDS]))
+
+    if base_fields is None or fields[S_PLAYERS] != base_fields[S_PLAYERS]:
+        mask |= S_PLAYERS
+        parts.append(pack_players(kind, fields[S_PLAYERS]))
+
+    if S_BREAKS in fields and fields[S_BREAKS][1]:
+        mask |= S_BREAKS
+        parts.append(U32.pack(fields[S_BREAKS][0]))
+        parts.append(pack_ids(fields[S_BREAKS][1]))
+
+    if base_fields is None:
+        flags |= F_KEYFRAME
+
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, kind, flags, seq) + BASE.pack(base_seq, mask) + b''.join(parts)
+
+def reply_from_view(kind, flags, fields):
+    '''
+    Rebuilds a dict shaped like the room state, holding only the keys that the message type carries.
+    '''
+    if kind == MSG_MENU:
+        players, ready, started = {}, {}, {}
+        for pid, record_flags, name in fields[S_PLAYERS]:
+            if record_flags & R_NAMED:
+                players[pid] = name
+            ready[pid] = bool(record_flags & R_READY)
+            started[pid] = bool(record_flags & R_STARTED)
+        return {
+            'full' : bool(flags & F_FULL),
+            'mode' : bool(flags & F_MODE),
+            'start' : bool(flags & F_START),
+            'players' : players,
+            'ready' : ready,
+            'started' : started
+        }
+
+    elif kind == MSG_RACE_SETUP:
+        players = {}
+        for pid, x, y, width, height, speed, accel, jump_accel, name in fields[S_PLAYERS]:
+            players[pid] = {
+                'x' : x,
+                'y' : y,
+                'width' : width,
+                'height' : height,
+                'speed' : speed,
+                'accel' : accel,
+                'jump_accel' : jump_accel,
+                'name' : name
+            }
+        p1, p2 = fields[S_PIDS]
+        return {'p1' : p1, 'p2' : p2, 'players-race' : players}
+
+    elif kind == MSG_RACE_TICK:
+        players, win, quit = {}, {}, {}
+        for pid, x, y, record_flags in fields[S_PLAYERS]:
+            players[pid] = {'x' : x, 'y' : y}
+            win[pid] = bool(record_flags & F_WIN)
+            quit[pid] = bool(record_flags & F_QUIT)
+        p1, p2 = fields[S_PIDS]
+        return {'p1' : p1, 'p2' : p2, 'players-race' : players, 'win' : win, 'quit' : quit,
+         'breaks' : fields.get(S_BREAKS, NO_BREAKS)}
+
+    players = {}
+    for pid, y, score, lose, name in fields[S_PLAYERS]:
+        players[pid] = [y, score, name, bool(lose)]
+    return {'players-endless' : players}
+
+
+class ReplyEncoder:
+    '''
+    Server side, one per connection.
+    Remembers the snapshots sent to the client so that replies can be diffed
+    against whichever one the client acknowledged last.
+    '''
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.sent = {}
+
+    def encode(self, kind, state, ack, answered=True):
+        flags, fields = build_view(kind, state)
+        if answered:
+            flags |= F_REPLY
+        self.seq += 1
+
+        base = self.sent.get(ack)
+        keyframe = (base is None or base[0] != kind or kind == MSG_RACE_SETUP
+         or self.seq % self.keyframe_interval == 0)
+
+        # The client has moved past anything older than its ack.
+        for old in [seq for seq in self.sent if seq < ack or seq <= self.seq - MAX_HISTORY]:
+            del self.sent[old]
+        self.sent[self.seq] = (kind, fields)
+
+        if keyframe:
+            return encode_view(kind, flags, self.seq, 0, fields)
+        return encode_view(kind, flags, self.seq, ack, fields, base[1])
+
+
+class ReplyDecoder:
+    '''
+    Client side, one per connection.
+    Applies delta replies on top of the snapshot they were diffed against.
+    ack is the seq to put in the header of the next request.
+    '''
+    def __init__(self):
+        self.ack = 0
+        self.answered = False
+        self.received = {}
+        self.reply = None # last reply decoded
+
+    def decode(self, payload):
+        buf = memoryview(payload)
+        magic, version, kind, flags, seq = HEADER.unpack_from(buf, 0)
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f'Unsupported protocol version {version}')
+        base_seq, mask = BASE.unpack_from(buf, HEADER.size)
+        offset = HEADER.size + BASE.size
+
+        if flags & F_KEYFRAME:
+            fields = {}
+        else:
+            base = self.received.get(base_seq)
+            if base is None or base[0] != kind:
+                # Should not happen on a reliable stream. Skip the frame and
+                # send ack 0 next, so the server answers with a keyframe.
+                # Until then the last good reply stands in for this one.
+                self.ack = 0
+                self.answered = bool(flags & F_REPLY)
+                return self.reply
+            fields = dict(base[1])
+
+        if mask & S_PIDS:
+            fields[S_PIDS] = PIDS.unpack_from(buf, offset)
+            offset += PIDS.size
+
+        if mask & S_PLAYERS:
+            fields[S_PLAYERS], offset = unpack_players(kind, buf, offset)
+
+        reply_fields = fields
+        if mask & S_BREAKS:
+            start, = U32.unpack_from(buf, offset)
+            ids, offset = unpack_ids(buf, offset + U32.size)
+            reply_fields = dict(fields)
+            reply_fields[S_BREAKS] = (start, ids)
+
+        for old in [old for old in self.received if old <= seq - MAX_HISTORY]:
+            del self.received[old]
+        self.received[seq] = (kind, fields)
+        self.ack = seq
+        self.answered = bool(flags & F_REPLY)
+
+        self.reply = reply_from_view(kind, flags & ~(F_KEYFRAME | F_REPLY), reply_fields)
+        return self.reply
@@ -0,0 +1,271 @@
+'''
+Rooms let one server process host many matches at once.
+
+Every room owns its own match state. Rooms are owned by the server's event loop:
+they are only ever touched from coroutines running on that loop, one message at
+a time, so no locking is needed around the state.
+'''
+
+DEFAULT_ROOM = 'main'
+MAX_PLAYERS = 2
+
+
+class Room:
+    '''
+    Represents a single match (at most two players) and its state.
+    '''
+    def __init__(self, name, mode=True):
+        self.name = name
+        self.members = set()
+        self.player_names = {}
+
+        # Race mode: append-only log of broken block ids. The seq of an entry is its index + 1.
+        self.break_log = []
+        self.broken = set()
+        self.racing = set()
+
+        self.inputs = [] # tick mode: (pid, message) waiting for the next tick.
+
+        self.state = {
+            'full' : False,
+            'mode' : mode,
+            'players' : {},
+            'players-endless': {},
+            'players-race': {},
+            'ready' : {},
+            'start' : False,
+            'started' : {},
+            'p1' : 0,
+            'p2' : 0,
+            'quit' : {},
+            'win' : {}
+        }
+
+    def is_full(self):
+        return len(self.members) >= MAX_PLAYERS
+
+    def is_empty(self):
+        return not self.members
+
+    def join(self, pid):
+        '''
+        Adds the player to the room. Returns False if the room is full.
+        '''
+        if pid in self.members:
+            return True
+        if self.is_full():
+            return False
+
+        self.members.add(pid)
+        return True
+
+    def leave(self, pid):
+        '''
+        Removes every trace of the player from the room.
+        '''
+        self.members.discard(pid)
+        self.racing.discard(pid)
+        self.inputs = [(other, received) for other, received in self.inputs if other != pid]
+        self.player_names.pop(pid, None)
+        for key in ['players', 'players-endless', 'players-race', 'ready', 'started', 'quit', 'win']:
+            self.state[key].pop(pid, None)
+
+        self.state['start'] = False
+        self.state['full'] = False
+
+    def summary(self):
+        '''
+        Returns the information shown in a room listing.
+        '''
+        return {
+            'name' : self.name,
+            'mode' : self.state['mode'],
+            'players' : list(self.state['players'].values()),
+            'full' : self.is_full()
+        }
+
+    def queue(self, pid, received):
+        '''
+        Tick mode: keeps the message until the next tick.
+        '''
+        self.inputs.append((pid, received))
+
+    def apply_inputs(self):
+        '''
+        Tick mode: applies every message queued since the last tick, in arrival order.
+        Returns the players whose message could not be applied, so the server
+        can drop them without stopping the other rooms.
+        '''
+        inputs, self.inputs = self.inputs, []
+        failed = []
+        for pid, received in inputs:
+            if pid in self.members and pid not in failed:
+                try:
+                    self.apply(pid, received)
+                except Exception as e:
+                    print(f'[Server] Bad message from {pid} in room {self.name}: {e!r}')
+                    failed.append(pid)
+        return failed
+
+    def reply(self, pid, received):
+        '''
+        Returns the state to send back to the player, given the last message it sent.
+        '''
+        if received['type'] == 'ingame-race' and not received['setup']:
+            # Send the breaks the client hasn't acknowledged yet.
+            ack = min(received['break-ack'], len(self.break_log))
+            return dict(self.state, breaks=(ack, self.break_log[ack:]))
+
+        return self.state
+
+    def apply(self, pid, received):
+        '''
+        Applies one message from the client to the room state.
+        The client sends different dicts depending on the state. check type first.
+        '''
+        # Menu updates.
+        if received['type'] == 'menu':
+            #print(f'[Server] Received {received}')
+            if len(self.state['players']) == 2 and pid not in self.state['players']:
+                self.state['full'] = True
+            else:
+                self.state['players'][pid] = received['name']
+                self.state['full'] = len(self.state['players']) == 2
+                self.player_names[pid] = received['name']
+
+            self.state['ready'][pid] = received['ready']
+
+            self.state['start'] = sum([status for status in self.state['ready'].values()]) == 2
+            
+            self.state['started'][pid] = received['started']
+
+            if received['changemode']:
+                self.state['mode'] = received['mode']
+
+
+        # Ingame updates
+        # note there are only two players in the game.
+        elif received['type'] == 'ingame-race':
+            if received['setup']:
+                print(f'[Server] ({self.name}) Setting up for', pid)
+                # A player setting up again means a new race: start a fresh break log.
+                if not self.racing or pid in self.racing:
+                    self.racing = set()
+                    self.break_log = []
+                    self.broken = set()
+                self.racing.add(pid)
+                self.state['quit'][pid] = False
+                self.state['win'][pid] = False
+                alternate = True
+                for key, value in self.state['players'].items():
+                    if alternate:
+                        self.state['players-race'][key] = {
+                            'x' : 64,
+                            'y' : 50,
+                            'width' : 32,
+                            'height' : 32,
+                            'speed' : 0,
+                            'accel' : 3,
+                            'jump_accel' : 15,
+                            'name' : self.player_names[key]
+                        }
+                        self.state['p1'] = key
+                        alternate = not alternate
+                    else:
+                        self.state['players-race'][key] = {
+                            'x' : 1100,
+                            'y' : 50,
+                            'width' : 32,
+                            'height' : 32,
+                            'speed' : 0,
+                            'accel' : 3,
+                            'jump_accel' : 15,
+                            'name' : self.player_names[key]
+                        }
+                        self.state['p2'] = key
+
+            else:
+                self.state['players-race'][pid]['x'] = received['player']['x']
+                self.state['players-race'][pid]['y'] = received['player']['y']
+
+                for block_id in received['breaks']:
+                    if block_id not in self.broken:
+                        self.broken.add(block_id)
+                        self.break_log.append(block_id)
+
+                self.state['quit'][pid] = received['quit']
+                self.state['win'][pid] = received['win']
+        
+        elif received['type'] == 'ingame-endless':
+            self.state['players-endless'][pid] = [received['player-y'], received['player-score'], self.player_names[pid], received['lose']]
+
+
+class RoomRegistry:
+    '''
+    Keeps track of every room on the server and which room each player is in.
+    '''
+    def __init__(self):
+        self.rooms = {}
+        self.player_rooms = {}
+
+    def get(self, name):
+        return self.rooms.get(name)
+
+    def room_of(self, pid):
+        return self.player_rooms.get(pid)
+
+    def create(self, name, mode=True):
+        '''
+        Creates a new room. Returns None if the name is already taken.
+        '''
+        if name in self.rooms:
+            return None
+
+        room = Room(name, mode)
+        self.rooms[name] = room
+        print(f'[Server] Created room {name}')
+        return room
+
+    def join(self, pid, name):
+        '''
+        Moves the player into the room. Returns the room, or None if it can't be joined.
+        '''
+        room = self.rooms.get(name)
+        if room is None:
+            return None
+
+        current = self.player_rooms.get(pid)
+        if current is room:
+            return room
+        if not room.join(pid):
+            return None
+
+        if current is not None:
+            self.leave(pid)
+        self.player_rooms[pid] = room
+        return room
+
+    def join_default(self, pid):
+        '''
+        Puts a player that never picked a room into the default room.
+        '''
+        if DEFAULT_ROOM not in self.rooms:
+            self.create(DEFAULT_ROOM)
+
+        return self.join(pid, DEFAULT_ROOM)
+
+    def leave(self, pid):
+        '''
+        Removes the player from its room, deleting the room once it is empty.
+        '''
+        room = self.player_rooms.pop(pid, None)
+        if room is None:
+            return
+
+        room.leave(pid)
+        if room.is_empty():
+            self.rooms.pop(room.name, None)
+            print(f'[Server] Closed room {room.name}')
+
+    def listing(self):
+        return [room.summary() for room in self.rooms.values()]
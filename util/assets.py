@@ -0,0 +1,92 @@
+import pygame
+import threading
+import time
+from util.setup import open_asset, generate_state_images, generate_player_images, generate_block_images, generate_level_thumbnails
+
+
+class NullSound:
+    '''
+    Stands in for a pygame Sound when the mixer is not initialized (eg. no audio device).
+    '''
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+    def fadeout(self, ms):
+        pass
+
+    def set_volume(self, value):
+        pass
+
+    def get_volume(self):
+        return 0
+
+
+def load_sound(path):
+    if not pygame.mixer.get_init():
+        return NullSound()
+    with open_asset(path) as f:
+        return pygame.mixer.Sound(file=f)
+
+
+class AssetRegistry:
+    '''
+    Loads each asset the first time it is asked for and shares that one copy
+    with every caller afterwards. Assets can also be loaded ahead of time on a
+    background thread with warm(). Load times are kept in timings.
+    '''
+    def __init__(self):
+        self.loaders = {}
+        self.assets = {}
+        self.timings = {} # name -> seconds spent loading
+        self.lock = threading.RLock()
+
+    def register(self, name, loader):
+        self.loaders[name] = loader
+
+    def get(self, name):
+        asset = self.assets.get(name)
+        if asset is not None:
+            return asset
+
+        with self.lock:
+            if name not in self.assets:
+                start = time.perf_counter()
+                self.assets[name] = self.loaders[name]()
+                self.timings[name] = time.perf_counter() - start
+            return self.assets[name]
+
+    def warm(self, names=None):
+        '''
+        Loads the given assets (all by default) on a background thread.
+        Returns the thread.
+        '''
+        names = list(self.loaders) if names is None else names
+
+        def load():
+            start = time.perf_counter()
+            for name in names:
+                self.get(name)
+            print(f'[Game] Warmed {len(names)} assets in {time.perf_counter() - start:.3f}s')
+
+        thread = threading.Thread(target=load, daemon=True, name='asset-warmer')
+        thread.start()
+        return thread
+
+
+ASSETS = AssetRegistry()
+
+# Images. Sprites need the display mode to be set before they are loaded (see util.atlas).
+ASSETS.register('states', generate_state_images)
+ASSETS.register('blocks', generate_block_images)
+ASSETS.register('player', generate_player_images)
+ASSETS.register('thumbnails', generate_level_thumbnails)
+
+# Sounds
+ASSETS.register('bgm', lambda: load_sound('res/sounds/bgm.wav'))
+ASSETS.register('munch', lambda: load_sound('res/sounds/munch.wav'))
+ASSETS.register('button_pass', lambda: load_sound('res/sounds/button_pass.wav'))
+ASSETS.register('pause', lambda: load_sound('res/sounds/pause.wav'))
+ASSETS.register('gameover', lambda: load_sound('res/sounds/gameover.wav'))
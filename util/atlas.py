@@ -0,0 +1,88 @@
+import pygame
+
+
+class TextureAtlas:
+    '''
+    Packs many small images into one display-format surface.
+    Images are handed out as subsurfaces of the atlas (handles): they blit
+    like any other Surface, and handle.get_offset() is their area in the atlas.
+    The atlas is built on first use, which must come after the display mode is
+    set so that it can be converted to the display's pixel format.
+    With a colorkey the atlas is opaque: images are flattened onto the
+    colorkey, so fully transparent pixels stay see-through but blits skip
+    per-pixel alpha blending. Use it only for images without soft edges.
+    '''
+    def __init__(self, groups, width=1024, padding=1, load=pygame.image.load, colorkey=None):
+        self.groups = groups # group name -> {key : path or [paths]}
+        self.load = load
+        self.width = width
+        self.padding = padding
+        self.colorkey = colorkey
+        self.surface = None
+        self.regions = {} # path -> Rect in the atlas
+        self.handles = {} # group name -> {key : handle or [handles]}
+
+    def paths(self):
+        found = []
+        for layout in self.groups.values():
+            for value in layout.values():
+                for path in (value if isinstance(value, list) else [value]):
+                    if path not in found:
+                        found.append(path)
+        return found
+
+    def build(self):
+        '''
+        Loads every image, packs them in rows (tallest first) and blits them into the atlas.
+        '''
+        images = {path : self.load(path) for path in self.paths()}
+
+        x, y, row_height = 0, 0, 0
+        for path in sorted(images, key=lambda p: images[p].get_height(), reverse=True):
+            width, height = images[path].get_size()
+            if x + width > self.width:
+                x, y, row_height = 0, y + row_height + self.padding, 0
+
+            self.regions[path] = pygame.Rect(x, y, width, height)
+            x += width + self.padding
+            row_height = max(row_height, height)
+
+        size = (self.width, y + row_height)
+        if self.colorkey is None:
+            surface = pygame.Surface(size, pygame.SRCALPHA)
+        else:
+            surface = pygame.Surface(size)
+            surface.fill(self.colorkey)
+        for path, image in images.items():
+            surface.blit(image, self.regions[path])
+
+        if self.colorkey is not None:
+            surface.set_colorkey(self.colorkey)
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert()
+        elif pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+
+        self.surface = surface
+        print(f'[Game] Built texture atlas {surface.get_size()} with {len(images)} images')
+
+    def region(self, path):
+        if self.surface is None:
+            self.build()
+        return self.regions[path]
+
+    def image(self, path):
+        area = self.region(path)
+        return self.surface.subsurface(area)
+
+    def group(self, name):
+        '''
+        Returns the group's layout with every path replaced by its handle.
+        Handles are made once and shared by every caller.
+        '''
+        if name not in self.handles:
+            self.handles[name] = {
+                key : [self.image(p) for p in value] if isinstance(value, list) else self.image(value)
+                for key, value in self.groups[name].items()
+            }
+        return self.handles[name]
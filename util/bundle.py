@@ -0,0 +1,126 @@
+import io
+import mmap
+import os
+import struct
+
+'''
+A single-file asset bundle: a table of contents followed by the raw files.
+
+    header  !4sI  magic, number of entries
+    entry   !H    name length, then the name (utf-8, '/' separated)
+            !QQ   offset from the start of the bundle, size
+    data    the files, back to back
+
+At runtime the bundle is memory-mapped and files are read straight out of the map.
+'''
+
+MAGIC = b'BMB1'
+HEADER = struct.Struct('!4sI')
+ENTRY = struct.Struct('!QQ')
+NAME_LENGTH = struct.Struct('!H')
+
+BUNDLE_NAME = 'assets.bundle'
+BUNDLE_SOURCES = ['res/bg', 'res/sprites', 'res/sounds', 'config.json']
+
+
+def build_bundle(out=BUNDLE_NAME, sources=BUNDLE_SOURCES, base='.'):
+    '''
+    Packs the source files and directories into one bundle at out.
+    '''
+    names = []
+    for source in sources:
+        path = os.path.join(base, source)
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for f in sorted(files):
+                    names.append(os.path.relpath(os.path.join(root, f), base).replace(os.sep, '/'))
+        else:
+            names.append(source)
+
+    toc_size = HEADER.size + sum(NAME_LENGTH.size + len(n.encode()) + ENTRY.size for n in names)
+    toc = [HEADER.pack(MAGIC, len(names))]
+    offset = toc_size
+    for name in names:
+        size = os.path.getsize(os.path.join(base, name))
+        encoded = name.encode()
+        toc.append(NAME_LENGTH.pack(len(encoded)) + encoded + ENTRY.pack(offset, size))
+        offset += size
+
+    with open(out, 'wb') as f:
+        f.write(b''.join(toc))
+        for name in names:
+            with open(os.path.join(base, name), 'rb') as src:
+                f.write(src.read())
+
+    print(f'[Build] Bundled {len(names)} files into {out} ({offset} bytes)')
+    return names
+
+
+class BundleFile(io.RawIOBase):
+    '''
+    A read-only file over one entry of the bundle, reading straight from the map.
+    '''
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = max(0, min(len(buffer), len(self.view) - self.position))
+        buffer[:n] = self.view[self.position:self.position + n]
+        self.position += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+
+class Bundle:
+    '''
+    A memory-mapped asset bundle made by build_bundle.
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.entries = {} # name -> (offset, size)
+
+        magic, count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an asset bundle')
+
+        position = HEADER.size
+        for _ in range(count):
+            (length,) = NAME_LENGTH.unpack_from(self.map, position)
+            position += NAME_LENGTH.size
+            name = bytes(self.map[position:position + length]).decode()
+            position += length
+            self.entries[name] = ENTRY.unpack_from(self.map, position)
+            position += ENTRY.size
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def data(self, name):
+        '''
+        Returns the entry as a memoryview into the map (no copy).
+        '''
+        offset, size = self.entries[name]
+        return self.view[offset:offset + size]
+
+    def open(self, name):
+        return BundleFile(self.data(name))
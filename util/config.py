@@ -0,0 +1,79 @@
+import atexit
+import json
+import os
+import threading
+
+
+class Config:
+    '''
+    The game settings, parsed once and shared by the whole process.
+    Reading is a dict lookup. set() updates the value right away, tells the
+    subscribers of that key, and leaves saving to a background thread that
+    waits for writes to settle, so many quick changes end up as one file write.
+    '''
+    def __init__(self, path, values, delay=0.5):
+        self.path = path
+        self.values = values
+        self.delay = delay # seconds to wait for more changes before writing
+        self.subscribers = {} # key -> [callback(value)]
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.saving = threading.Lock() # one file write at a time
+        self.changed = threading.Event()
+        self.writer = None
+
+        atexit.register(self.flush)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.dirty = True
+
+        for callback in self.subscribers.get(key, []):
+            callback(value)
+
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_behind, daemon=True, name='config-writer')
+            self.writer.start()
+        self.changed.set()
+
+    def subscribe(self, key, callback):
+        '''
+        Calls callback(value) whenever key is set.
+        '''
+        self.subscribers.setdefault(key, []).append(callback)
+
+    def write_behind(self):
+        while True:
+            self.changed.wait()
+            self.changed.clear()
+            # keep waiting while changes are still coming in.
+            while self.changed.wait(self.delay):
+                self.changed.clear()
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the settings to disk now, if anything changed.
+        '''
+        with self.saving:
+            with self.lock:
+                if not self.dirty:
+                    return
+                data = json.dumps(self.values)
+                self.dirty = False
+
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as f:
+                f.write(data)
+            os.replace(temp, self.path)
+            print(f'[Game] Saved settings to {self.path}')
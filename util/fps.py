@@ -1,16 +1,10 @@
 import pygame
-from game.states import Settings
-
-def update_fps(state, original):
-    if isinstance(state, Settings):
-        return state.fps
-    else:
-        return original
+from util.text_cache import get_font, render_text
 
 def draw_fps(screen, clock, x=0, y=0):
     '''
     Draw the fps onto the screen.
     '''
-    COURIER = pygame.font.SysFont('Courier', 16)
-    fps_overlay = COURIER.render(str(int(clock.get_fps())), True, pygame.Color("Red"))
+    COURIER = get_font('Courier', 16)
+    fps_overlay = render_text(COURIER, str(int(clock.get_fps())), pygame.Color("Red"))
     screen.blit(fps_overlay, (x, y))
\ No newline at end of file
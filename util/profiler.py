@@ -0,0 +1,117 @@
+import pygame
+import json
+import time
+from collections import deque
+from util.text_cache import get_font
+
+'''
+Per-phase frame timings for the main loop, shown as an overlay (F3) and
+saved to a json file on request (F4).
+'''
+
+TOGGLE_KEY = pygame.K_F3
+DUMP_KEY = pygame.K_F4
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class FrameProfiler:
+    '''
+    Times each phase of a frame. Call begin() at the start of the frame, then
+    lap(phase) at the end of every phase; the last window frames are kept.
+    Time spent inside a phase (eg. collisions during update) can be counted
+    with add(phase, seconds) for any extra phase passed in nested.
+    '''
+    def __init__(self, phases=('events', 'update', 'draw', 'display'), window=300, refresh=15, nested=()):
+        self.phases = phases + nested
+        self.samples = {phase : deque(maxlen=window) for phase in self.phases + ('frame',)}
+        self.current = dict.fromkeys(self.phases, 0)
+        self.visible = False
+        self.refresh = refresh # frames between overlay text updates
+        self.frames = 0
+        self.panel = None
+        self.info = {}
+        self.frame_start = self.last = time.perf_counter()
+
+    def begin(self):
+        self.current = dict.fromkeys(self.phases, 0)
+        self.frame_start = self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def add(self, phase, seconds):
+        self.current[phase] += seconds
+
+    def end(self, **info):
+        '''
+        Ends the frame. info (eg. block count) is shown and saved with the timings.
+        '''
+        for phase, seconds in self.current.items():
+            self.samples[phase].append(seconds)
+        self.samples['frame'].append(time.perf_counter() - self.frame_start)
+        self.info = info
+        self.frames += 1
+
+    def stats(self):
+        '''
+        Returns {phase : {p50, p95, p99, max}} in milliseconds.
+        '''
+        stats = {}
+        for phase, samples in self.samples.items():
+            ordered = sorted(samples)
+            stats[phase] = {
+                'p50' : round(percentile(ordered, 50) * 1000, 3),
+                'p95' : round(percentile(ordered, 95) * 1000, 3),
+                'p99' : round(percentile(ordered, 99) * 1000, 3),
+                'max' : round(ordered[-1] * 1000, 3) if ordered else 0
+            }
+        return stats
+
+    def events(self, events):
+        for event in events:
+            if event.type == pygame.KEYDOWN:
+                if event.key == TOGGLE_KEY:
+                    self.visible = not self.visible
+                elif event.key == DUMP_KEY:
+                    self.dump()
+
+    def dump(self, path=None):
+        path = path or f'frame_stats_{time.strftime("%Y%m%d_%H%M%S")}.json'
+        with open(path, 'w') as f:
+            json.dump({'phases' : self.stats(), 'info' : self.info, 'frames' : self.frames}, f, indent=2)
+        print(f'[Game] Saved frame stats to {path}')
+        return path
+
+    def draw(self, screen, x=0, y=0):
+        # The panel is only rebuilt every few frames, so the numbers stay readable.
+        if self.frames % self.refresh == 0 or self.panel is None:
+            self.panel = self.render_panel()
+        screen.blit(self.panel, (x, y))
+
+    def render_panel(self):
+        stats = self.stats()
+        lines = ['phase     p50    p95    p99 (ms)'] + [
+            f'{phase:<8}{s["p50"]:>6.2f} {s["p95"]:>6.2f} {s["p99"]:>6.2f}' for phase, s in stats.items()
+        ] + [f'{key}: {value}' for key, value in self.info.items()]
+
+        # Rendered directly: these lines rarely repeat, so they would only push
+        # the HUD and button text out of the shared TEXT_CACHE.
+        font = get_font('Courier', 14)
+        rendered = [font.render(line, True, (255, 255, 255)) for line in lines]
+        width = max(r.get_width() for r in rendered) + 10
+        height = sum(r.get_height() for r in rendered) + 10
+
+        panel = pygame.Surface((width, height))
+        panel.set_alpha(170)
+        y = 5
+        for r in rendered:
+            panel.blit(r, (5, y))
+            y += r.get_height()
+        return panel
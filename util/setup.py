@@ -1,11 +1,30 @@
 import pygame
 import os, sys, json
+from util.atlas import TextureAtlas
+from util.bundle import Bundle, BUNDLE_NAME
+from util.config import Config
 
 
+CONFIG = None
+
 def get_config():
+    '''
+    Returns the shared settings (see util.config), read from config.json on first use.
+    '''
+    global CONFIG
+    if CONFIG is None:
+        CONFIG = Config(get_path('config.json'), read_config())
+    return CONFIG
+
+def read_config():
     config = {}
-    with open(get_path('config.json'), 'r') as f:
-        config = json.load(f)
+    try:
+        with open(get_path('config.json'), 'r') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        if BUNDLE is None or 'config.json' not in BUNDLE:
+            raise
+        config = json.loads(bytes(BUNDLE.data('config.json')))
     
     return config
 
@@ -13,78 +32,24 @@ def generate_state_images():
     config = get_config()
     SIZE = config['size']
 
+    # Blitted every frame, so they are converted to the display format
+    # (the display mode is set before the states are loaded).
     images = {
-        'menu' : pygame.transform.scale(pygame.image.load(get_path('res/bg/bg_menu.jpg')), (SIZE[0], SIZE[1])),
-        'game' : pygame.transform.scale(pygame.image.load(get_path('res/bg/bg_game.jpg')), (SIZE[0], SIZE[1])),
-        'pause' : pygame.transform.scale(pygame.image.load(get_path('res/bg/bg_pause.jpg')), (SIZE[0], SIZE[1]))
+        'menu' : pygame.transform.scale(load_image('res/bg/bg_menu.jpg'), (SIZE[0], SIZE[1])).convert(),
+        'game' : pygame.transform.scale(load_image('res/bg/bg_game.jpg'), (SIZE[0], SIZE[1])).convert(),
+        'pause' : pygame.transform.scale(load_image('res/bg/bg_pause.jpg'), (SIZE[0], SIZE[1])).convert()
     }
 
     return images
 
 def generate_player_images():
-    images = {
-        'playerfront' : pygame.image.load(get_path('res/sprites/player_small_front1.png')),
-        'playerleft' : pygame.image.load(get_path('res/sprites/player_small_left1.png')),
-        'playerright' : pygame.image.load(get_path('res/sprites/player_small_right1.png'))
-    }
-
-    return images
+    return SPRITE_ATLAS.group('player')
 
 def generate_level_thumbnails():
-    images = { i : pygame.image.load(get_path(f'res/bg/l_{i}.png')) for i in range(10)}
-
-    return images
+    return SPRITE_ATLAS.group('thumbnails')
 
 def generate_block_images():
-    images = {
-        'normal' : pygame.image.load(get_path('res/sprites/block_big1.png')),
-        'invis' : pygame.image.load(get_path('res/sprites/transparent.png')),
-        'win' : pygame.image.load(get_path('res/sprites/win_block.png')),
-        'tough' : [
-            pygame.image.load(get_path('res/sprites/block_tough1.png')),
-            pygame.image.load(get_path('res/sprites/block_tough2.png')),
-            pygame.image.load(get_path('res/sprites/block_tough3.png'))
-        ],
-        'energy' : pygame.image.load(get_path('res/sprites/block_energy.png')),
-        'thorns' : pygame.image.load(get_path('res/sprites/block_thorns.png')),
-        'slow' : [
-            pygame.image.load(get_path('res/sprites/block_slow1.png')),
-            pygame.image.load(get_path('res/sprites/block_slow2.png'))
-        ],
-        'fear' : pygame.image.load(get_path('res/sprites/block_fear.png')),
-        'super' : pygame.image.load(get_path('res/sprites/block_super.png')),
-        'mushroom' : pygame.image.load(get_path('res/sprites/block_mushroom.png')),
-        'steel' : [
-            pygame.image.load(get_path('res/sprites/block_steel1.png')),
-            pygame.image.load(get_path('res/sprites/block_steel2.png'))
-        ],
-        'ruby' : pygame.image.load(get_path('res/sprites/block_ruby.png'))
-    }
-
-    return images
-
-def generate_button_sound():
-    sounds = {
-        'button_pass' : pygame.mixer.Sound(get_path('res/sounds/button_pass.wav'))
-    }
-
-    return sounds
-
-def generate_eat_sound():
-    sounds = {
-        'munch' : pygame.mixer.Sound(get_path('res/sounds/munch.wav'))
-    }
-
-    return sounds
-
-def generate_menu_sounds():
-    sounds = {
-        'pause' : pygame.mixer.Sound(get_path('res/sounds/pause.wav')),
-        'gameover' : pygame.mixer.Sound(get_path('res/sounds/gameover.wav'))
-    }
-
-    return sounds
-
+    return BLOCK_ATLAS.group('blocks')
 
 def get_path(path):
     try:
@@ -92,4 +57,60 @@ def get_path(path):
     except:
         base_path = os.path.abspath(".")
 
-    return os.path.join(base_path, path)
\ No newline at end of file
+    return os.path.join(base_path, path)
+
+def open_asset(path):
+    '''
+    Opens a file under res/ for reading, from the asset bundle when there is one.
+    '''
+    if BUNDLE is not None and path in BUNDLE:
+        return BUNDLE.open(path)
+    return open(get_path(path), 'rb')
+
+def load_image(path):
+    with open_asset(path) as f:
+        return pygame.image.load(f, path)
+
+
+# Built by build.py (see util.bundle). Without it, assets are read from the loose files.
+BUNDLE = Bundle(get_path(BUNDLE_NAME)) if os.path.exists(get_path(BUNDLE_NAME)) else None
+
+
+# Player and UI sprites share one display-format atlas, built on first use.
+SPRITE_ATLAS = TextureAtlas({
+    'player' : {
+        'playerfront' : 'res/sprites/player_small_front1.png',
+        'playerleft' : 'res/sprites/player_small_left1.png',
+        'playerright' : 'res/sprites/player_small_right1.png'
+    },
+    'thumbnails' : { i : f'res/bg/l_{i}.png' for i in range(10)}
+}, load=load_image)
+
+# Block images are opaque (bar the empty invisible block), so they get an
+# opaque colorkeyed atlas of their own: blitting them needs no alpha blending.
+BLOCK_ATLAS = TextureAtlas({
+    'blocks' : {
+        'normal' : 'res/sprites/block_big1.png',
+        'invis' : 'res/sprites/transparent.png',
+        'win' : 'res/sprites/win_block.png',
+        'tough' : [
+            'res/sprites/block_tough1.png',
+            'res/sprites/block_tough2.png',
+            'res/sprites/block_tough3.png'
+        ],
+        'energy' : 'res/sprites/block_energy.png',
+        'thorns' : 'res/sprites/block_thorns.png',
+        'slow' : [
+            'res/sprites/block_slow1.png',
+            'res/sprites/block_slow2.png'
+        ],
+        'fear' : 'res/sprites/block_fear.png',
+        'super' : 'res/sprites/block_super.png',
+        'mushroom' : 'res/sprites/block_mushroom.png',
+        'steel' : [
+            'res/sprites/block_steel1.png',
+            'res/sprites/block_steel2.png'
+        ],
+        'ruby' : 'res/sprites/block_ruby.png'
+    }
+}, load=load_image, colorkey=(255, 0, 255))
@@ -0,0 +1,56 @@
+import pygame
+from collections import OrderedDict
+
+'''
+Shared fonts and rendered text, so that ui drawn every frame
+does not create new fonts or re-render text that has not changed.
+'''
+
+FONTS = {}
+
+
+def get_font(name, size, bold=False, italic=False):
+    '''
+    Returns the shared SysFont for these settings, creating it on first use.
+    '''
+    key = (name, size, bold, italic)
+    font = FONTS.get(key)
+    if font is None:
+        font = FONTS[key] = pygame.font.SysFont(name, size, bold=bold, italic=italic)
+    return font
+
+
+class TextCache:
+    '''
+    A bounded LRU cache of rendered text surfaces, keyed by (font, text, color).
+    Surfaces are shared, do not draw on them.
+    '''
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), bool(antialias))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = self.surfaces[key] = font.render(text, antialias, color)
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses, 'size' : len(self.surfaces), 'fonts' : len(FONTS)}
+
+
+TEXT_CACHE = TextCache()
+
+
+def render_text(font, text, color, antialias=True):
+    return TEXT_CACHE.render(font, text, color, antialias)